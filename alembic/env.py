@@ -9,7 +9,7 @@ import sys
 import os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from database import Base
+from database import URL_DATABASE, Base
 import models
 
 
@@ -28,6 +28,10 @@ if config.config_file_name is not None:
 # target_metadata = mymodel.Base.metadata
 target_metadata = Base.metadata
 
+# Migrate the database the app uses; alembic.ini only holds a fallback.
+if URL_DATABASE:
+    config.set_main_option("sqlalchemy.url", URL_DATABASE.replace("%", "%%"))
+
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
 # my_important_option = config.get_main_option("my_important_option")
@@ -0,0 +1,76 @@
+"""product images
+
+Revision ID: 4f73b3019b01
+Revises: 502ebeed9b77
+Create Date: 2026-10-18 17:52:40.532611
+
+"""
+import json
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4f73b3019b01'
+down_revision: Union[str, Sequence[str], None] = '502ebeed9b77'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    product_images = op.create_table(
+        'product_images',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('product_id', sa.Integer(), nullable=False),
+        sa.Column('position', sa.Integer(), nullable=False),
+        sa.Column('path', sa.Text(), nullable=False),
+        sa.Column('size', sa.BigInteger(), nullable=True),
+        sa.Column('sha256', sa.String(length=64), nullable=True),
+        sa.Column('width', sa.Integer(), nullable=True),
+        sa.Column('height', sa.Integer(), nullable=True),
+        sa.Column('content_type', sa.String(), nullable=True),
+        sa.ForeignKeyConstraint(['product_id'], ['products.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index(op.f('ix_product_images_id'), 'product_images', ['id'], unique=False)
+    op.create_index('ix_product_images_product_id_position', 'product_images', ['product_id', 'position'], unique=False)
+
+    conn = op.get_bind()
+    blobs = {path: (sha256, size) for path, sha256, size in conn.execute(sa.text('SELECT path, sha256, size FROM blobs'))}
+    rows = []
+    for product_id, images_secundary in conn.execute(sa.text('SELECT id, images_secundary FROM products')):
+        try:
+            paths = json.loads(images_secundary or '[]')
+        except json.JSONDecodeError:
+            continue
+        for position, path in enumerate(p for p in paths if p):
+            sha256, size = blobs.get(path, (None, None))
+            rows.append({'product_id': product_id, 'position': position, 'path': path, 'sha256': sha256, 'size': size})
+    if rows:
+        op.bulk_insert(product_images, rows)
+
+    with op.batch_alter_table('products') as batch_op:
+        batch_op.drop_column('images_secundary')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('products') as batch_op:
+        batch_op.add_column(sa.Column('images_secundary', sa.Text(), nullable=True))
+
+    conn = op.get_bind()
+    images = {}
+    for product_id, path in conn.execute(sa.text('SELECT product_id, path FROM product_images ORDER BY product_id, position')):
+        images.setdefault(product_id, []).append(path)
+    for product_id, paths in images.items():
+        conn.execute(
+            sa.text('UPDATE products SET images_secundary = :images WHERE id = :id'),
+            {'images': json.dumps(paths), 'id': product_id},
+        )
+
+    op.drop_index('ix_product_images_product_id_position', table_name='product_images')
+    op.drop_index(op.f('ix_product_images_id'), table_name='product_images')
+    op.drop_table('product_images')
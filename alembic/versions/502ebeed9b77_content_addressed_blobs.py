@@ -0,0 +1,61 @@
+"""content addressed blobs
+
+Revision ID: 502ebeed9b77
+Revises: 19b47d4cb4ef
+Create Date: 2026-10-18 16:40:12.118204
+
+"""
+import json
+from collections import Counter
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '502ebeed9b77'
+down_revision: Union[str, Sequence[str], None] = '19b47d4cb4ef'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    blobs = op.create_table(
+        'blobs',
+        sa.Column('path', sa.String(), nullable=False),
+        sa.Column('sha256', sa.String(length=64), nullable=True),
+        sa.Column('size', sa.BigInteger(), nullable=True),
+        sa.Column('refcount', sa.Integer(), server_default='0', nullable=False),
+        sa.PrimaryKeyConstraint('path'),
+    )
+    op.create_index(
+        'ix_blobs_unreferenced', 'blobs', ['path'], unique=False,
+        postgresql_where=sa.text('refcount <= 0'),
+        sqlite_where=sa.text('refcount <= 0'),
+    )
+
+    # Files uploaded before this revision keep their names; register them
+    # so that they are reference counted like new uploads.
+    conn = op.get_bind()
+    refs = Counter()
+    for image_main, images_secundary in conn.execute(sa.text('SELECT image_main, images_secundary FROM products')):
+        if image_main:
+            refs[image_main] += 1
+        try:
+            refs.update(p for p in json.loads(images_secundary or '[]') if p)
+        except json.JSONDecodeError:
+            pass
+    for (image,) in conn.execute(sa.text('SELECT image FROM categories')):
+        if image:
+            refs[image] += 1
+
+    if refs:
+        op.bulk_insert(blobs, [{'path': path, 'refcount': count} for path, count in refs.items()])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_blobs_unreferenced', table_name='blobs')
+    op.drop_table('blobs')
@@ -0,0 +1,44 @@
+"""product search indexes
+
+Revision ID: 508f3bf8956e
+Revises: 4f73b3019b01
+Create Date: 2026-10-18 18:21:05.713940
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '508f3bf8956e'
+down_revision: Union[str, Sequence[str], None] = '4f73b3019b01'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Full-text search is PostgreSQL only; other databases skip it.
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.execute(
+        "ALTER TABLE products ADD COLUMN search_vector tsvector "
+        "GENERATED ALWAYS AS (to_tsvector('simple', coalesce(name, '') || ' ' || coalesce(description, ''))) STORED"
+    )
+    op.create_index('ix_products_search_vector', 'products', ['search_vector'], postgresql_using='gin')
+    op.create_index(
+        'ix_products_name_trgm', 'products', ['name'],
+        postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'},
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.drop_index('ix_products_name_trgm', table_name='products')
+    op.drop_index('ix_products_search_vector', table_name='products')
+    op.drop_column('products', 'search_vector')
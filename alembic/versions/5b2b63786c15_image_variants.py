@@ -0,0 +1,42 @@
+"""image variants
+
+Revision ID: 5b2b63786c15
+Revises: 508f3bf8956e
+Create Date: 2026-10-18 19:02:47.381126
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5b2b63786c15'
+down_revision: Union[str, Sequence[str], None] = '508f3bf8956e'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'image_variants',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('source_path', sa.String(), nullable=False),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('format', sa.String(), nullable=False),
+        sa.Column('path', sa.String(), nullable=False),
+        sa.Column('width', sa.Integer(), nullable=True),
+        sa.Column('height', sa.Integer(), nullable=True),
+        sa.Column('size', sa.BigInteger(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('source_path', 'name', 'format', name='uq_image_variants_source_name_format'),
+    )
+    op.create_index(op.f('ix_image_variants_id'), 'image_variants', ['id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_image_variants_id'), table_name='image_variants')
+    op.drop_table('image_variants')
@@ -0,0 +1,36 @@
+"""resource versions
+
+Revision ID: 7c41e0d2a9f3
+Revises: 5b2b63786c15
+Create Date: 2026-10-18 19:40:31.554218
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7c41e0d2a9f3'
+down_revision: Union[str, Sequence[str], None] = '5b2b63786c15'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # SQLite cannot ADD COLUMN with a non-constant default, so copy the table there.
+    recreate = 'always' if op.get_bind().dialect.name == 'sqlite' else 'auto'
+    for table in ('products', 'categories'):
+        with op.batch_alter_table(table, recreate=recreate) as batch_op:
+            batch_op.add_column(sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+            batch_op.add_column(sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for table in ('products', 'categories'):
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('updated_at')
+            batch_op.drop_column('version')
@@ -0,0 +1,82 @@
+"""categories products composite key
+
+Revision ID: de6f5498ab0c
+Revises: 7c41e0d2a9f3
+Create Date: 2026-10-18 21:14:09.305127
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'de6f5498ab0c'
+down_revision: Union[str, Sequence[str], None] = '7c41e0d2a9f3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _set_aside(table: str) -> str:
+    """Rename ``table`` out of the way, freeing the names of its constraints
+    (PostgreSQL keeps them on rename) for the table that replaces it."""
+    old = f'{table}_old'
+    op.rename_table(table, old)
+    inspector = sa.inspect(op.get_bind())
+    for fk in inspector.get_foreign_keys(old):
+        if fk['name']:
+            op.drop_constraint(fk['name'], old, type_='foreignkey')
+    pk = inspector.get_pk_constraint(old)
+    if pk['name']:
+        op.drop_constraint(pk['name'], old, type_='primary')
+    return old
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.drop_index(op.f('ix_categories_products_id'), table_name='categories_products')
+    old = _set_aside('categories_products')
+
+    op.create_table(
+        'categories_products',
+        sa.Column('product_id', sa.Integer(), nullable=False),
+        sa.Column('category_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['category_id'], ['categories.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['product_id'], ['products.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('product_id', 'category_id'),
+    )
+    # The surrogate key allowed duplicate links, and SQLite did not enforce
+    # the foreign keys, so copy each live link once.
+    op.execute(
+        f'INSERT INTO categories_products (product_id, category_id) '
+        f'SELECT DISTINCT product_id, category_id FROM {old} '
+        f'WHERE product_id IN (SELECT id FROM products) AND category_id IN (SELECT id FROM categories)'
+    )
+    op.drop_table(old)
+    op.create_index(
+        'ix_categories_products_category_id_product_id', 'categories_products',
+        ['category_id', 'product_id'], unique=False,
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_categories_products_category_id_product_id', table_name='categories_products')
+    old = _set_aside('categories_products')
+
+    op.create_table(
+        'categories_products',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('product_id', sa.Integer(), nullable=False),
+        sa.Column('category_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['category_id'], ['categories.id']),
+        sa.ForeignKeyConstraint(['product_id'], ['products.id']),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.execute(
+        f'INSERT INTO categories_products (product_id, category_id) '
+        f'SELECT product_id, category_id FROM {old} ORDER BY product_id, category_id'
+    )
+    op.drop_table(old)
+    op.create_index(op.f('ix_categories_products_id'), 'categories_products', ['id'], unique=False)
@@ -0,0 +1,81 @@
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional, Tuple
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+from utils.metrics import BCRYPT_REJECTED, BCRYPT_SECONDS
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+HASH_POOL_KIND = os.getenv("HASH_POOL_KIND", "thread")
+HASH_POOL_SIZE = int(os.getenv("HASH_POOL_SIZE", str(os.cpu_count() or 1)))
+HASH_QUEUE_SIZE = int(os.getenv("HASH_QUEUE_SIZE", "32"))
+
+# min and max equal to the default make passlib report hashes created with
+# any other cost as needing an update, so logins rehash them.
+bcrypt_context = CryptContext(
+    schemes=['bcrypt'],
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
+
+_executor: Optional[Executor] = None
+_in_flight = 0
+
+
+def _hash(password: str) -> str:
+    return bcrypt_context.hash(password)
+
+
+def _verify_and_update(password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    return bcrypt_context.verify_and_update(password, hashed_password)
+
+
+def _get_executor() -> Executor:
+    global _executor
+    if _executor is None:
+        if HASH_POOL_KIND == "process":
+            # Spawned, not forked, like the image pool: a forked worker would
+            # copy the server's event loop, threads and signal handlers.
+            _executor = ProcessPoolExecutor(max_workers=HASH_POOL_SIZE, mp_context=multiprocessing.get_context("spawn"))
+        else:
+            _executor = ThreadPoolExecutor(max_workers=HASH_POOL_SIZE, thread_name_prefix="bcrypt")
+    return _executor
+
+
+async def _submit(operation: str, fn, *args):
+    global _in_flight
+    if _in_flight >= HASH_POOL_SIZE + HASH_QUEUE_SIZE:
+        BCRYPT_REJECTED.inc()
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Authentication is busy, try again later",
+            headers={"Retry-After": "1"},
+        )
+    _in_flight += 1
+    start = time.perf_counter()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_get_executor(), fn, *args)
+    finally:
+        _in_flight -= 1
+        BCRYPT_SECONDS.labels(operation).observe(time.perf_counter() - start)
+
+
+async def hash_password(password: str) -> str:
+    return await _submit("hash", _hash, password)
+
+
+async def verify_password(password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Return whether the password matches and, if the stored hash uses an
+    outdated cost, a replacement hash to persist."""
+    return await _submit("verify", _verify_and_update, password, hashed_password)
+
+
+def shutdown_executor(wait: bool = False):
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=wait, cancel_futures=True)
+        _executor = None
@@ -2,16 +2,17 @@ from datetime import timedelta, datetime, timezone
 from typing import Annotated
 from fastapi import APIRouter, Depends, HTTPException, status
 from pydantic import BaseModel
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from starlette import status
 from models import Users
-from passlib.context import CryptContext
 from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer
 from dotenv import load_dotenv
 import os
-from database import get_db
+from database import get_async_db
 from auth.schemas import CreateUserRequest, Token
 from auth.utils import authenticate_user, create_access_token
+from auth.hashing import hash_password
+from utils.ratelimit import RATE_LIMIT_AUTH, RateLimit
 
 load_dotenv()
 
@@ -20,24 +21,24 @@ router = APIRouter(
     tags=['auth']
 )
 
-bcrypt_context = CryptContext(schemes=['bcrypt'])
+db_dependency = Annotated[AsyncSession, Depends(get_async_db)]
+# Both endpoints run bcrypt; they share one bucket per client IP.
+auth_limit = RateLimit(RATE_LIMIT_AUTH, "auth")
 
-db_dependency = Annotated[Session, Depends(get_db)]
-
-@router.post('/', status_code=status.HTTP_201_CREATED)
+@router.post('/', status_code=status.HTTP_201_CREATED, dependencies=[Depends(auth_limit)])
 async def create_user(db: db_dependency,
                       create_user_request: CreateUserRequest):
     create_user_model = Users(
         username=create_user_request.username,
-        hashed_password=bcrypt_context.hash(create_user_request.password)
+        hashed_password=await hash_password(create_user_request.password)
     )
 
     db.add(create_user_model)
-    db.commit() 
+    await db.commit()
 
-@router.post('/token', response_model=Token)
+@router.post('/token', response_model=Token, dependencies=[Depends(auth_limit)])
 async def login_for_access_token(form_data: Annotated[OAuth2PasswordRequestForm, Depends()], db: db_dependency):
-    user = authenticate_user(form_data.username, form_data.password, db)
+    user = await authenticate_user(form_data.username, form_data.password, db)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
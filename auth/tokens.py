@@ -0,0 +1,127 @@
+import hashlib
+import importlib
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+from jose import jwt as jose_jwt, JWTError
+
+SECRET_KEY = os.getenv("SECRET_KEY")
+ALGORITHM = os.getenv("ALGORITHM")
+JWT_BACKEND = os.getenv("JWT_BACKEND", "jose")
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+
+
+class InvalidToken(Exception):
+    pass
+
+
+def _parse_keys(raw: Optional[str]) -> Dict[str, str]:
+    """``JWT_KEYS`` holds ``kid:secret`` pairs separated by commas. Without
+    it the single ``SECRET_KEY`` is used under the ``default`` kid."""
+    if not raw:
+        return {"default": SECRET_KEY}
+    keys = {}
+    for pair in raw.split(","):
+        kid, _, secret = pair.strip().partition(":")
+        if kid and secret:
+            keys[kid] = secret
+    return keys
+
+
+SIGNING_KEYS = _parse_keys(os.getenv("JWT_KEYS"))
+ACTIVE_KID = os.getenv("JWT_ACTIVE_KID") or next(iter(SIGNING_KEYS))
+
+
+class _JoseBackend:
+    def encode(self, claims, key, kid):
+        return jose_jwt.encode(claims, key, algorithm=ALGORITHM, headers={"kid": kid})
+
+    def header(self, token):
+        try:
+            return jose_jwt.get_unverified_header(token)
+        except JWTError as e:
+            raise InvalidToken(str(e))
+
+    def decode(self, token, key):
+        try:
+            return jose_jwt.decode(token, key, algorithms=[ALGORITHM])
+        except JWTError as e:
+            raise InvalidToken(str(e))
+
+
+class _PyJWTBackend:
+    def __init__(self):
+        self.jwt = importlib.import_module("jwt")
+
+    def encode(self, claims, key, kid):
+        return self.jwt.encode(claims, key, algorithm=ALGORITHM, headers={"kid": kid})
+
+    def header(self, token):
+        try:
+            return self.jwt.get_unverified_header(token)
+        except self.jwt.InvalidTokenError as e:
+            raise InvalidToken(str(e))
+
+    def decode(self, token, key):
+        try:
+            return self.jwt.decode(token, key, algorithms=[ALGORITHM])
+        except self.jwt.InvalidTokenError as e:
+            raise InvalidToken(str(e))
+
+
+backend = _PyJWTBackend() if JWT_BACKEND == "pyjwt" else _JoseBackend()
+
+
+class TokenCache:
+    """Verified tokens keyed by their SHA-256, each kept until its ``exp``."""
+
+    def __init__(self, max_entries: int = TOKEN_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: OrderedDict = OrderedDict()
+
+    def get(self, digest: bytes) -> Optional[dict]:
+        entry = self._entries.get(digest)
+        if entry is None:
+            return None
+        expires_at, kid, claims = entry
+        if expires_at <= time.time() or kid not in SIGNING_KEYS:
+            del self._entries[digest]
+            return None
+        self._entries.move_to_end(digest)
+        return claims
+
+    def put(self, digest: bytes, expires_at: float, kid: str, claims: dict):
+        if self.max_entries <= 0:
+            return
+        self._entries[digest] = (expires_at, kid, claims)
+        self._entries.move_to_end(digest)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+
+token_cache = TokenCache()
+
+
+def encode_token(claims: dict) -> str:
+    return backend.encode(claims, SIGNING_KEYS[ACTIVE_KID], ACTIVE_KID)
+
+
+def decode_token(token: str) -> dict:
+    digest = hashlib.sha256(token.encode()).digest()
+    claims = token_cache.get(digest)
+    if claims is not None:
+        return claims
+
+    kid = backend.header(token).get("kid") or ACTIVE_KID
+    key = SIGNING_KEYS.get(kid)
+    if key is None:
+        raise InvalidToken("unknown kid")
+    claims = backend.decode(token, key)
+    exp = claims.get("exp")
+    if isinstance(exp, (int, float)):
+        token_cache.put(digest, exp, kid, claims)
+    return claims
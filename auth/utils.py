@@ -1,40 +1,40 @@
 from datetime import timedelta, datetime, timezone
-from sqlalchemy.orm import Session
-import os
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi.security import OAuth2PasswordBearer
 from fastapi import Depends, HTTPException, status
-from jose import jwt, JWTError
-from passlib.context import CryptContext
 import models
-
-SECRET_KEY = os.getenv("SECRET_KEY")
-ALGORITHM = os.getenv("ALGORITHM")
+from auth.hashing import verify_password
+from auth.tokens import InvalidToken, decode_token, encode_token
 
 oauth2_bearer = OAuth2PasswordBearer(tokenUrl="/auth/token")
-bcrypt_context = CryptContext(schemes=['bcrypt'])
 
 
-def authenticate_user(username: str, password: str, db: Session):
-    user = db.query(models.Users).filter(models.Users.username == username).first()
+async def authenticate_user(username: str, password: str, db: AsyncSession):
+    user = await db.scalar(select(models.Users).where(models.Users.username == username))
     if not user:
         return False
-    if not bcrypt_context.verify(password, user.hashed_password):
+    valid, new_hash = await verify_password(password, user.hashed_password)
+    if not valid:
         return False
+    if new_hash:
+        user.hashed_password = new_hash
+        await db.commit()
     return user
 
 def create_access_token(username: str, user_id: int, expires_delta: timedelta):
     encode = {'sub':username, 'id': user_id}
     expires = datetime.now(timezone.utc) + expires_delta
-    encode.update({'exp' : expires})
-    return jwt.encode(encode, SECRET_KEY, algorithm=ALGORITHM)
+    encode.update({'exp' : int(expires.timestamp())})
+    return encode_token(encode)
 
-def get_current_user(token: str = Depends(oauth2_bearer)):
+async def get_current_user(token: str = Depends(oauth2_bearer)):
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_token(token)
         username: str = payload.get("sub")
         user_id: int = payload.get("id")
         if username is None or user_id is None:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
         return {"username": username, "id": user_id}
-    except JWTError:
+    except InvalidToken:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
\ No newline at end of file
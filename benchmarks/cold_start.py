@@ -0,0 +1,88 @@
+"""Measure cold start: the time from spawning the server process until it
+answers its first request with 200, and how fast the first requests are.
+
+The schema must exist (``alembic upgrade head``); the server gets the
+environment of this script.
+
+    python benchmarks/cold_start.py --runs 10 --path /products/?limit=50
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.dirname(__file__))
+from common import dump
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def cold_start(path: str, first_requests: int, timeout: float) -> dict:
+    port = free_port()
+    cmd = [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"]
+    url = f"http://127.0.0.1:{port}{path}"
+    started = time.perf_counter()
+    server = subprocess.Popen(cmd, cwd=ROOT)
+    try:
+        with httpx.Client(timeout=timeout) as client:
+            deadline = started + timeout
+            while True:
+                if server.poll() is not None:
+                    raise SystemExit(f"server exited with status {server.returncode}")
+                if time.perf_counter() > deadline:
+                    raise SystemExit("server did not answer in time")
+                attempt = time.perf_counter()
+                try:
+                    response = client.get(url)
+                except httpx.TransportError:
+                    time.sleep(0.005)
+                    continue
+                if response.status_code == 200:
+                    break
+                raise SystemExit(f"{path} answered {response.status_code}")
+            ready = time.perf_counter() - started
+            first = time.perf_counter() - attempt
+
+            latencies = []
+            for _ in range(first_requests):
+                start = time.perf_counter()
+                client.get(url)
+                latencies.append(time.perf_counter() - start)
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+    return {"first_200_s": ready, "first_request_s": first, "first_requests_ms": [round(s * 1000, 3) for s in latencies]}
+
+
+def main(args):
+    runs = [cold_start(args.path, args.first_requests, args.timeout) for _ in range(args.runs)]
+    ready = [r["first_200_s"] for r in runs]
+    following = [ms for r in runs for ms in r["first_requests_ms"]]
+    dump({
+        "path": args.path,
+        "runs": args.runs,
+        "first_200_median_ms": round(statistics.median(ready) * 1000, 1),
+        "first_200_min_ms": round(min(ready) * 1000, 1),
+        "first_200_max_ms": round(max(ready) * 1000, 1),
+        "first_request_median_ms": round(statistics.median(r["first_request_s"] for r in runs) * 1000, 3),
+        "next_requests_median_ms": round(statistics.median(following), 3) if following else None,
+    })
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--path", default="/products/?limit=50")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--first-requests", type=int, default=10, help="requests timed after the first 200")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    main(parser.parse_args())
@@ -0,0 +1,67 @@
+"""Compare two ``suite.py --output`` results.
+
+Prints throughput and latency percentiles per operation with the change
+relative to the baseline, and exits with status 1 when any operation got
+slower (p95 or p99) or lost throughput by more than ``--threshold`` percent.
+
+    python benchmarks/compare.py base.json head.json --threshold 10
+"""
+import argparse
+import json
+import sys
+
+# metric, True when a larger value is better
+METRICS = (("throughput_rps", True), ("p50_ms", False), ("p95_ms", False), ("p99_ms", False))
+GATED = ("throughput_rps", "p95_ms", "p99_ms")
+
+
+def change(base: float, head: float) -> float:
+    if not base:
+        return 0.0
+    return (head - base) / base * 100
+
+
+def compare(base: dict, head: dict, threshold: float):
+    rows, regressions = [], []
+    names = [n for n in base["operations"] if n in head["operations"]] + ["overall"]
+    for name in names:
+        old = base["overall"] if name == "overall" else base["operations"][name]
+        new = head["overall"] if name == "overall" else head["operations"][name]
+        for metric, higher_is_better in METRICS:
+            delta = change(old[metric], new[metric])
+            worse = -delta if higher_is_better else delta
+            flag = ""
+            if metric in GATED and worse > threshold:
+                flag = "REGRESSION"
+                regressions.append(f"{name} {metric}")
+            rows.append((name, metric, old[metric], new[metric], delta, flag))
+        if new["errors"] > old["errors"]:
+            regressions.append(f"{name} errors")
+            rows.append((name, "errors", old["errors"], new["errors"], 0.0, "REGRESSION"))
+    return rows, regressions
+
+
+def main(args):
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.head) as f:
+        head = json.load(f)
+    for key in ("database", "products", "concurrency", "workers", "mix"):
+        if base.get(key) != head.get(key):
+            print(f"warning: {key} differs ({base.get(key)} vs {head.get(key)})", file=sys.stderr)
+
+    print(f"{base.get('commit', args.base)} -> {head.get('commit', args.head)}")
+    rows, regressions = compare(base, head, args.threshold)
+    for name, metric, old, new, delta, flag in rows:
+        print(f"{name:<10} {metric:<15} {old:>12} {new:>12} {delta:>+8.1f}%  {flag}")
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) over {args.threshold}%: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("base")
+    parser.add_argument("head")
+    parser.add_argument("--threshold", type=float, default=10.0, help="allowed slowdown in percent")
+    main(parser.parse_args())
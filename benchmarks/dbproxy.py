@@ -0,0 +1,80 @@
+"""A TCP proxy in front of the database that delays every reply, to
+benchmark the API against a database with a slow round trip (another zone,
+a busy server) instead of one on localhost.
+
+    python benchmarks/dbproxy.py --listen 127.0.0.1:6543 --target 127.0.0.1:5432 --delay-ms 5
+    URL_DATABASE=postgresql://postgres@127.0.0.1:6543/api uvicorn main:app
+    python benchmarks/latency.py --url http://localhost:8000/products/1
+
+Each chunk the database sends reaches the client ``--delay-ms`` later; the
+chunks keep their order and are not throttled, so the proxy adds latency
+to every query, not a bandwidth limit.
+"""
+import argparse
+import asyncio
+import time
+
+
+def _address(value: str):
+    host, _, port = value.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+async def _pipe(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, delay: float):
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def read():
+        while data := await reader.read(65536):
+            queue.put_nowait((time.monotonic() + delay, data))
+        queue.put_nowait((None, b""))
+
+    async def write():
+        while True:
+            due, data = await queue.get()
+            if due is None:
+                break
+            wait = due - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            writer.write(data)
+            await writer.drain()
+
+    try:
+        await asyncio.gather(read(), write())
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def main(args):
+    target_host, target_port = _address(args.target)
+    delay = args.delay_ms / 1000
+
+    async def handle(client_reader, client_writer):
+        try:
+            server_reader, server_writer = await asyncio.open_connection(target_host, target_port)
+        except OSError:
+            client_writer.close()
+            return
+        await asyncio.gather(
+            _pipe(client_reader, server_writer, 0),
+            _pipe(server_reader, client_writer, delay),
+        )
+
+    host, port = _address(args.listen)
+    server = await asyncio.start_server(handle, host, port)
+    print(f"Forwarding {args.listen} to {args.target} with {args.delay_ms} ms added to every reply", flush=True)
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--listen", default="127.0.0.1:6543")
+    parser.add_argument("--target", default="127.0.0.1:5432")
+    parser.add_argument("--delay-ms", type=float, default=5.0)
+    try:
+        asyncio.run(main(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,45 @@
+"""Latency of a single GET endpoint at a fixed concurrency.
+
+Start the API (``uvicorn main:app``) and run, once on the old code and once
+on the new one:
+
+    python benchmarks/latency.py --url http://localhost:8000/products/1 --concurrency 64 --requests 5000
+"""
+import argparse
+import asyncio
+import os
+import sys
+
+import httpx
+
+sys.path.append(os.path.dirname(__file__))
+from common import dump, run_fixed_concurrency
+
+
+async def main(args):
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=args.timeout) as client:
+        for _ in range(args.warmup):
+            await client.get(args.url)
+
+        async def operation(_):
+            try:
+                response = await client.get(args.url)
+            except httpx.TransportError:
+                # Dropped or timed out: an error, not the end of the run.
+                return False
+            return response.status_code < 400
+
+        result = await run_fixed_concurrency(operation, args.concurrency, args.requests)
+    result.update({"url": args.url, "concurrency": args.concurrency})
+    dump(result)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", required=True)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--warmup", type=int, default=50)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    asyncio.run(main(parser.parse_args()))
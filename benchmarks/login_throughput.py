@@ -0,0 +1,49 @@
+"""Login throughput against a running API.
+
+Creates the user if needed and then posts to /auth/token at a fixed
+concurrency. Responses with status 503 (hashing pool saturated) are
+reported separately from other errors.
+
+    python benchmarks/login_throughput.py --base-url http://localhost:8000 --concurrency 32 --requests 500
+"""
+import argparse
+import asyncio
+import os
+import sys
+
+import httpx
+
+sys.path.append(os.path.dirname(__file__))
+from common import dump, run_fixed_concurrency
+
+
+async def main(args):
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=args.timeout) as client:
+        await client.post("/auth/", json={"username": args.username, "password": args.password})
+        rejected = 0
+
+        async def operation(_):
+            nonlocal rejected
+            response = await client.post(
+                "/auth/token",
+                data={"username": args.username, "password": args.password},
+            )
+            if response.status_code == 503:
+                rejected += 1
+            return response.status_code == 200
+
+        result = await run_fixed_concurrency(operation, args.concurrency, args.requests)
+    result.update({"concurrency": args.concurrency, "rejected_503": rejected})
+    dump(result)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--username", default="bench-user")
+    parser.add_argument("--password", default="bench-password")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,81 @@
+"""Search latency against a synthetic catalog.
+
+With ``--seed N`` the products table is filled up to N rows first, using
+``generate_series`` so a million rows take seconds instead of a bulk import.
+The database comes from ``URL_DATABASE`` and must be PostgreSQL with the
+search migration applied (``alembic upgrade head``).
+
+    python benchmarks/search.py --base-url http://localhost:8000 --seed 1000000 --concurrency 32 --requests 5000
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import sys
+
+import httpx
+from sqlalchemy import create_engine, text
+
+sys.path.append(os.path.dirname(__file__))
+from common import dump, run_fixed_concurrency
+
+WORDS = [
+    "phone", "laptop", "camera", "speaker", "monitor", "keyboard", "mouse", "tablet",
+    "charger", "headset", "router", "printer", "watch", "drone", "console", "cable",
+]
+ADJECTIVES = ["red", "blue", "black", "wireless", "portable", "gaming", "compact", "pro"]
+QUERIES = ["phone", "wireless mouse", "lapt", "gaming monitor", "pro camera", "keybaord", "red cab", "tablet 42"]
+
+
+def seed(url: str, rows: int):
+    engine = create_engine(url)
+    with engine.begin() as conn:
+        existing = conn.scalar(text("SELECT count(*) FROM products"))
+        missing = rows - existing
+        if missing > 0:
+            conn.execute(
+                text("""
+                    INSERT INTO products (name, description, image_main, active)
+                    SELECT
+                        (:adjectives)[1 + g % cardinality(:adjectives)] || ' '
+                            || (:words)[1 + (g / 7) % cardinality(:words)] || ' ' || g,
+                        'Synthetic ' || (:words)[1 + (g / 3) % cardinality(:words)]
+                            || ' for benchmarking, batch ' || g / 1000,
+                        'uploads/benchmark.jpg',
+                        g % 10 <> 0
+                    FROM generate_series(:start, :stop) AS g
+                """),
+                {"adjectives": ADJECTIVES, "words": WORDS, "start": existing + 1, "stop": rows},
+            )
+            conn.execute(text("ANALYZE products"))
+    engine.dispose()
+    return max(missing, 0)
+
+
+async def main(args):
+    inserted = seed(os.environ["URL_DATABASE"], args.seed) if args.seed else 0
+    queries = itertools.cycle(QUERIES)
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=args.timeout) as client:
+        async def operation(_):
+            params = {"q": next(queries), "limit": args.limit}
+            if args.active_only:
+                params["active"] = "true"
+            response = await client.get("/products/search", params=params)
+            return response.status_code < 400
+
+        result = await run_fixed_concurrency(operation, args.concurrency, args.requests)
+    result.update({"seeded": inserted, "concurrency": args.concurrency, "limit": args.limit})
+    dump(result)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--active-only", action="store_true")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    asyncio.run(main(parser.parse_args()))
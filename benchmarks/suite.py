@@ -0,0 +1,314 @@
+"""End-to-end benchmark of the API under a mixed workload.
+
+Boots ``main:app`` with uvicorn against PostgreSQL (``--database-url``,
+``BENCH_DATABASE_URL`` or a local ``fastapi_bench`` database) or, when none
+is reachable, a temporary SQLite file. Seeds a synthetic catalog and drives
+a weighted mix of requests at a fixed concurrency. The result is printed
+as JSON and optionally written to ``--output`` for ``compare.py``.
+
+    python benchmarks/suite.py --products 100000 --concurrency 32 --requests 20000 --output base.json
+    python benchmarks/suite.py --mix get=50,list=20,login=5,create=10,update=15 --reset
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+
+import httpx
+from PIL import Image
+from sqlalchemy import MetaData, create_engine, func, insert, select, text
+from sqlalchemy.engine import make_url
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.dirname(__file__))
+sys.path.insert(0, ROOT)
+from common import dump, summarize
+from utils.pagination import encode_cursor
+
+DEFAULT_POSTGRES_URL = "postgresql://postgres@localhost:5432/fastapi_bench"
+DEFAULT_MIX = "get=60,list=20,login=5,create=5,update=10"
+USERNAME = "bench-user"
+PASSWORD = "bench-password"
+
+
+def parse_mix(value: str) -> dict:
+    mix = {}
+    for item in value.split(","):
+        name, _, weight = item.partition("=")
+        mix[name.strip()] = float(weight)
+    unknown = set(mix) - set(OPERATIONS)
+    if unknown:
+        raise SystemExit(f"unknown operations in --mix: {', '.join(sorted(unknown))}")
+    return mix
+
+
+def pick_database(url: str) -> str:
+    candidate = url or os.getenv("BENCH_DATABASE_URL") or DEFAULT_POSTGRES_URL
+    if make_url(candidate).get_backend_name() != "postgresql":
+        return candidate
+    try:
+        engine = create_engine(candidate, connect_args={"connect_timeout": 3})
+        with engine.connect():
+            pass
+        engine.dispose()
+        return candidate
+    except Exception as exc:
+        if url:
+            raise SystemExit(f"cannot connect to {candidate}: {exc}")
+        path = os.path.join(tempfile.mkdtemp(prefix="bench-"), "bench.db")
+        print(f"PostgreSQL not reachable ({exc.__class__.__name__}), using SQLite at {path}", file=sys.stderr)
+        return f"sqlite:///{path}"
+
+
+def seed(url: str, products: int, categories: int, reset: bool, rng: random.Random) -> int:
+    os.environ["URL_DATABASE"] = url
+    import models
+
+    engine = create_engine(url)
+    if reset:
+        # Every table, alembic_version included, so that the migrations
+        # below build the schema from scratch.
+        tables = MetaData()
+        tables.reflect(engine)
+        tables.drop_all(engine)
+    # The schema the app runs on, with the objects only migrations create.
+    subprocess.run([sys.executable, "-m", "alembic", "upgrade", "head"], cwd=ROOT, env={**os.environ, "URL_DATABASE": url}, check=True)
+    with engine.begin() as conn:
+        existing_categories = conn.scalar(select(func.count()).select_from(models.Categories))
+        if existing_categories < categories:
+            conn.execute(insert(models.Categories), [
+                {"name": f"Category {i}", "description": f"Synthetic category {i}", "image": "uploads/bench/category.png"}
+                for i in range(existing_categories, categories)
+            ])
+        category_ids = conn.scalars(select(models.Categories.id)).all()
+
+        existing = conn.scalar(select(func.count()).select_from(models.Products))
+        for start in range(existing, products, 5000):
+            stop = min(start + 5000, products)
+            ids = conn.scalars(
+                insert(models.Products).returning(models.Products.id, sort_by_parameter_order=True),
+                [
+                    {
+                        "name": f"Product {i}",
+                        "description": f"Synthetic product {i} for benchmarking",
+                        "image_main": "uploads/bench/product.png",
+                        "active": i % 10 != 0,
+                    }
+                    for i in range(start, stop)
+                ],
+            ).all()
+            links = set()
+            for product_id in ids:
+                for category_id in rng.sample(category_ids, min(2, len(category_ids))):
+                    links.add((product_id, category_id))
+            conn.execute(insert(models.Categories_Products), [
+                {"product_id": p, "category_id": c} for p, c in sorted(links)
+            ])
+        count = conn.scalar(select(func.count()).select_from(models.Products))
+        if engine.dialect.name == "postgresql":
+            conn.execute(text("ANALYZE"))
+    engine.dispose()
+    return count
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(url: str, port: int, workers: int, upload_dir: str) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        "URL_DATABASE": url,
+        "UPLOAD_DIR": upload_dir,
+        "SECRET_KEY": os.getenv("SECRET_KEY", "bench-secret"),
+        "ALGORITHM": os.getenv("ALGORITHM", "HS256"),
+        # Every simulated user comes from the same address.
+        "RATE_LIMIT_ENABLED": os.getenv("RATE_LIMIT_ENABLED", "false"),
+    }
+    cmd = [
+        sys.executable, "-m", "uvicorn", "main:app",
+        "--host", "127.0.0.1", "--port", str(port),
+        "--workers", str(workers), "--log-level", "warning",
+    ]
+    return subprocess.Popen(cmd, cwd=ROOT, env=env)
+
+
+async def wait_ready(client: httpx.AsyncClient, server: subprocess.Popen, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise SystemExit(f"server exited with status {server.returncode}")
+        try:
+            if (await client.get("/products/", params={"limit": 1})).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise SystemExit("server did not become ready")
+
+
+def _image(rng: random.Random) -> bytes:
+    # Noise makes every upload a new blob and gives the variant workers
+    # something real to decode, like user photos.
+    size = rng.randint(64, 256)
+    out = io.BytesIO()
+    Image.frombytes("RGB", (size, size), rng.randbytes(size * size * 3)).save(out, "PNG")
+    return out.getvalue()
+
+
+class Workload:
+    def __init__(self, client: httpx.AsyncClient, products: int, category_ids: list, token: str, rng: random.Random):
+        self.client = client
+        self.products = products
+        self.category_ids = category_ids
+        self.headers = {"Authorization": f"Bearer {token}"}
+        self.rng = rng
+
+    def _product_id(self) -> int:
+        return self.rng.randint(1, self.products)
+
+    def _categories(self) -> str:
+        return ",".join(str(c) for c in self.rng.sample(self.category_ids, min(2, len(self.category_ids))))
+
+    async def get(self):
+        return await self.client.get(f"/products/{self._product_id()}")
+
+    async def list(self):
+        params = {"limit": 50}
+        if self.rng.random() < 0.8:
+            params["cursor"] = encode_cursor({"id": self._product_id()})
+        if self.rng.random() < 0.3:
+            params["category_id"] = self.rng.choice(self.category_ids)
+        return await self.client.get("/products/", params=params)
+
+    async def login(self):
+        return await self.client.post("/auth/token", data={"username": USERNAME, "password": PASSWORD})
+
+    async def create(self):
+        files = [("image_main", ("main.png", io.BytesIO(_image(self.rng)), "image/png"))]
+        files += [("images_secundary", (f"s{i}.png", io.BytesIO(_image(self.rng)), "image/png")) for i in range(2)]
+        data = {"name": f"Bench {self.rng.random():.8f}", "active": "true", "category_ids": self._categories()}
+        return await self.client.post("/products/", headers=self.headers, data=data, files=files)
+
+    async def update(self):
+        data = {"name": f"Renamed {self.rng.random():.8f}", "category_ids": self._categories()}
+        return await self.client.put(f"/products/{self._product_id()}", headers=self.headers, data=data)
+
+
+OPERATIONS = ("get", "list", "login", "create", "update")
+
+
+async def run(workload: Workload, mix: dict, concurrency: int, total: int, warmup: int) -> dict:
+    names = list(mix)
+    weights = [mix[n] for n in names]
+    plan = workload.rng.choices(names, weights, k=warmup + total)
+    samples = {name: [] for name in names}
+    errors = Counter()
+    statuses = {name: Counter() for name in names}
+    counter = iter(enumerate(plan))
+    started = None
+
+    async def worker():
+        nonlocal started
+        for i, name in counter:
+            if i == warmup and started is None:
+                started = time.perf_counter()
+            start = time.perf_counter()
+            try:
+                response = await getattr(workload, name)()
+                status = response.status_code
+            except httpx.HTTPError as exc:
+                status = exc.__class__.__name__
+            elapsed = time.perf_counter() - start
+            if i < warmup:
+                continue
+            samples[name].append(elapsed)
+            statuses[name][str(status)] += 1
+            if not isinstance(status, int) or status >= 400:
+                errors[name] += 1
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - (started or time.perf_counter())
+
+    operations = {}
+    for name in names:
+        operations[name] = {**summarize(samples[name], errors[name], elapsed), "status": dict(statuses[name])}
+    overall = summarize([s for v in samples.values() for s in v], sum(errors.values()), elapsed)
+    return {"elapsed_s": round(elapsed, 3), "overall": overall, "operations": operations}
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+async def main(args):
+    rng = random.Random(args.seed)
+    url = pick_database(args.database_url)
+    products = seed(url, args.products, args.categories, args.reset, rng)
+
+    port = args.port or free_port()
+    upload_dir = args.upload_dir or tempfile.mkdtemp(prefix="bench-uploads-")
+    server = start_server(url, port, args.workers, upload_dir)
+    try:
+        limits = httpx.Limits(max_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=args.timeout) as client:
+            await wait_ready(client, server)
+            await client.post("/auth/", json={"username": USERNAME, "password": PASSWORD})
+            token = (await client.post("/auth/token", data={"username": USERNAME, "password": PASSWORD})).json()["access_token"]
+            categories = (await client.get("/categories/", params={"limit": 200})).json()["items"]
+
+            workload = Workload(client, products, [c["id"] for c in categories], token, rng)
+            result = await run(workload, parse_mix(args.mix), args.concurrency, args.requests, args.warmup)
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+    result = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "database": make_url(url).get_backend_name(),
+        "products": products,
+        "categories": args.categories,
+        "concurrency": args.concurrency,
+        "workers": args.workers,
+        "mix": args.mix,
+        "seed": args.seed,
+        **result,
+    }
+    dump(result)
+    if args.output:
+        with open(args.output, "w") as out:
+            json.dump(result, out, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default="")
+    parser.add_argument("--reset", action="store_true", help="drop all tables and migrate from scratch first (destructive)")
+    parser.add_argument("--products", type=int, default=10000)
+    parser.add_argument("--categories", type=int, default=50)
+    parser.add_argument("--mix", default=DEFAULT_MIX)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--warmup", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--upload-dir", default="")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--output", default="")
+    asyncio.run(main(parser.parse_args()))
@@ -1,21 +1,143 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from dotenv import load_dotenv
+from utils.metrics import TimedPoolMixin
+import asyncio
+import logging
 import os
+import time
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 URL_DATABASE = os.getenv("URL_DATABASE")
+URL_DATABASE_ASYNC = os.getenv("URL_DATABASE_ASYNC")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "0"))
+# Connections opened at startup, capped at DB_POOL_SIZE.
+DB_POOL_WARMUP = int(os.getenv("DB_POOL_WARMUP", str(DB_POOL_SIZE)))
+# How long startup retries the warm-up while the database is unreachable.
+DB_STARTUP_TIMEOUT = float(os.getenv("DB_STARTUP_TIMEOUT", "30"))
 
-engine = create_engine(URL_DATABASE)
+_ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+    "sqlite+pysqlite": "sqlite+aiosqlite",
+}
 
-SessionLocal: sessionmaker = sessionmaker(autoflush=False, bind=engine)
 
-Base = declarative_base()
+def _async_url(url: str):
+    url = make_url(url)
+    return url.set(drivername=_ASYNC_DRIVERS.get(url.drivername, url.drivername))
+
+
+def _connect_args(url) -> dict:
+    if url.get_backend_name() != "postgresql" or not DB_STATEMENT_TIMEOUT_MS:
+        return {}
+    return {"server_settings": {"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)}}
+
+
+def _engine_options(url) -> dict:
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+        "connect_args": _connect_args(url),
+    }
+
+
+class TimedAsyncPool(TimedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def _enable_foreign_keys(dbapi_connection, connection_record):
+    # SQLite ignores foreign keys, and so ON DELETE CASCADE, unless asked.
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+
+def _configure(engine):
+    if engine.dialect.name == "sqlite":
+        event.listen(engine, "connect", _enable_foreign_keys)
+
+
+# Created by init_engine(), from the app's lifespan or a CLI's entry point,
+# so that importing the app does not build an engine or touch the database.
+# Refer to it as database.async_engine, not by importing the name. The only
+# engine, so that serve.py's DB_CONNECTION_BUDGET covers every connection.
+async_engine = None
+
+AsyncSessionLocal: async_sessionmaker = async_sessionmaker(
+    autoflush=False,
+    expire_on_commit=False,
+)
+
+
+def init_engine():
+    global async_engine
+    if async_engine is None:
+        async_url = make_url(URL_DATABASE_ASYNC) if URL_DATABASE_ASYNC else _async_url(URL_DATABASE)
+        async_engine = create_async_engine(async_url, poolclass=TimedAsyncPool, **_engine_options(async_url))
+        _configure(async_engine.sync_engine)
+        AsyncSessionLocal.configure(bind=async_engine)
+    return async_engine
+
+
+async def dispose_engine():
+    global async_engine
+    if async_engine is not None:
+        await async_engine.dispose()
+        async_engine = None
+
+
+async def warm_up(statements=(), connections: int = DB_POOL_WARMUP, timeout: float = DB_STARTUP_TIMEOUT) -> bool:
+    """Open ``connections`` pooled connections and run ``statements`` on
+    each, so that the first requests neither connect nor compile them (and,
+    with asyncpg, find them prepared).
+
+    Waits up to ``timeout`` seconds for the database to accept connections;
+    never raises, the pool connects on demand once the database is back.
+    """
+
+    async def prepare():
+        async with AsyncSessionLocal() as db:
+            await db.connection()
+            for statement in statements:
+                await db.execute(statement)
+            await db.rollback()
+
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            async with async_engine.connect():
+                break
+        except (OSError, SQLAlchemyError) as exc:
+            if time.monotonic() >= deadline:
+                logger.warning("Database unreachable, starting with a cold pool: %s", exc)
+                return False
+            logger.info("Database not ready, retrying: %s", exc)
+            await asyncio.sleep(1)
 
-def get_db():
-    db = SessionLocal()
     try:
+        await asyncio.gather(*(prepare() for _ in range(max(1, min(connections, DB_POOL_SIZE)))))
+    except SQLAlchemyError as exc:
+        logger.warning("Database warm-up failed: %s", exc)
+        return False
+    return True
+
+
+Base = declarative_base()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
\ No newline at end of file
@@ -0,0 +1,32 @@
+"""Remove uploaded files that no product or category references anymore.
+With --sweep, also remove files under UPLOAD_DIR that no row references.
+
+    python gc_uploads.py --batch-size 500
+    python gc_uploads.py --sweep --grace 3600
+"""
+import argparse
+import asyncio
+
+import database
+from database import AsyncSessionLocal
+from utils.file import GC_BATCH_SIZE, SWEEP_GRACE, collect_garbage, sweep_orphans
+
+
+async def main(batch_size: int, sweep: bool, grace: float):
+    database.init_engine()
+    async with AsyncSessionLocal() as db:
+        collected = await collect_garbage(db, batch_size)
+        swept = await sweep_orphans(db, grace=grace, batch_size=batch_size) if sweep else 0
+    await database.dispose_engine()
+    print(f"Removed {collected} unreferenced files")
+    if sweep:
+        print(f"Swept {swept} orphaned files")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--batch-size", type=int, default=GC_BATCH_SIZE)
+    parser.add_argument("--sweep", action="store_true", help="also remove files no row references")
+    parser.add_argument("--grace", type=float, default=SWEEP_GRACE, help="seconds a file must be old to be swept")
+    args = parser.parse_args()
+    asyncio.run(main(args.batch_size, args.sweep, args.grace))
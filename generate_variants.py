@@ -0,0 +1,51 @@
+"""Render the image variants of files uploaded before they were configured.
+
+    python generate_variants.py --batch-size 200
+
+With --all, every stored file is processed, e.g. after IMAGE_VARIANT_SIZES
+or IMAGE_VARIANT_QUALITY changed; variants that match the settings are kept.
+"""
+import argparse
+import asyncio
+
+from sqlalchemy import exists, select, true
+
+import models
+import database
+from database import AsyncSessionLocal
+from utils.file import StoredFile
+from utils.images import generate_variants, shutdown_executor
+
+
+async def main(batch_size: int, all_files: bool = False):
+    database.init_engine()
+    processed = 0
+    last_path = ""
+    async with AsyncSessionLocal() as db:
+        while True:
+            rows = (await db.execute(
+                select(models.Blobs.path, models.Blobs.sha256, models.Blobs.size)
+                .where(
+                    models.Blobs.refcount > 0,
+                    models.Blobs.path > last_path,
+                    true() if all_files else ~exists().where(models.Image_Variants.source_path == models.Blobs.path),
+                )
+                .order_by(models.Blobs.path)
+                .limit(batch_size)
+            )).all()
+            if not rows:
+                break
+            await generate_variants([StoredFile(path, sha256, size) for path, sha256, size in rows])
+            processed += len(rows)
+            last_path = rows[-1].path
+    shutdown_executor()
+    await database.dispose_engine()
+    print(f"Processed {processed} files")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--all", action="store_true", help="also files that have variants, to apply changed settings")
+    args = parser.parse_args()
+    asyncio.run(main(args.batch_size, args.all))
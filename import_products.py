@@ -0,0 +1,38 @@
+"""Import products from an NDJSON or CSV file.
+
+    python import_products.py catalog.ndjson
+    python import_products.py catalog.csv --batch-size 5000
+
+Each record has ``name``, optional ``description``, ``active`` (default
+true) and ``categories``: a list of category names or ids, or in CSV a
+single column with values separated by ``|``.
+"""
+import argparse
+import asyncio
+import sys
+
+import database
+from database import AsyncSessionLocal
+from utils.bulk_import import IMPORT_BATCH_SIZE, detect_format, import_products
+
+
+async def main(args) -> int:
+    database.init_engine()
+    fmt = args.format or detect_format(args.path)
+    with open(args.path, "rb") as stream:
+        async with AsyncSessionLocal() as db:
+            report = await import_products(db, stream, fmt, args.batch_size)
+    await database.dispose_engine()
+
+    for error in report.errors:
+        print(f"row {error.row}: {error.error}", file=sys.stderr)
+    print(f"Inserted {report.inserted} products, {report.failed} rows failed")
+    return 1 if report.failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=["csv", "ndjson"])
+    parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE)
+    sys.exit(asyncio.run(main(parser.parse_args())))
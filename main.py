@@ -1,17 +1,77 @@
+import asyncio
+import contextlib
+import logging
+import time
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Depends
-import models
-from database import engine
+from fastapi.responses import ORJSONResponse
+import database
 import auth 
 import auth.routes as auth
+from auth import hashing
 from auth.utils import get_current_user
 from routes import products, categories
+from utils.file import GC_INTERVAL, UPLOAD_URL_PREFIX, BodySizeLimitMiddleware, run_collector
+from utils.static import build_upload_files
+from utils.compression import CompressionMiddleware, available_encodings
+from utils.ratelimit import RATE_LIMIT_ENABLED, RATE_LIMIT_WRITES, RateLimit, RateLimitMiddleware, by_user
+from utils.metrics import METRICS_ENABLED, MetricsMiddleware, instrument_engine, mark_process_dead, metrics
+from utils import images, profiler
 
-app = FastAPI()
 
-current_user: dict = Depends(get_current_user)
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    start = time.perf_counter()
+    engine = database.init_engine()
+    if METRICS_ENABLED:
+        instrument_engine(engine, "async")
+    if profiler.SQL_PROFILE:
+        profiler.instrument_engine(engine)
+    warm = await database.warm_up(products.warmup_queries() + categories.warmup_queries())
+    logger.info("Startup took %.0f ms (warm pool: %s)", (time.perf_counter() - start) * 1000, warm)
+    collector = asyncio.create_task(run_collector()) if GC_INTERVAL > 0 else None
+    yield
+    if collector is not None:
+        collector.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await collector
+    # Worker processes outlive the server unless they are told to stop.
+    images.shutdown_executor(wait=True)
+    hashing.shutdown_executor(wait=True)
+    await database.dispose_engine()
+    mark_process_dead()
 
-models.Base.metadata.create_all(bind=engine)
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+
+current_user: dict = Depends(get_current_user)
 
 app.include_router(auth.router)
 app.include_router(products.router)
-app.include_router(categories.router)
\ No newline at end of file
+app.include_router(categories.router)
+app.mount(UPLOAD_URL_PREFIX, build_upload_files(), name="uploads")
+
+# Added before the metrics so that request latency includes compression
+# and rejected requests are counted.
+if available_encodings():
+    app.add_middleware(CompressionMiddleware)
+
+app.add_middleware(BodySizeLimitMiddleware)
+
+if RATE_LIMIT_ENABLED:
+    # Checked before the multipart body of an upload is read.
+    writes = RateLimit(RATE_LIMIT_WRITES, "writes", key=by_user)
+    app.add_middleware(RateLimitMiddleware, rules=[
+        (("POST", "PUT", "PATCH", "DELETE"), "/products", writes),
+        (("POST", "PUT", "PATCH", "DELETE"), "/categories", writes),
+    ])
+
+if METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+    app.add_route("/metrics", metrics, include_in_schema=False)
+
+if profiler.SQL_PROFILE:
+    app.add_middleware(profiler.SQLProfilerMiddleware)
@@ -1,4 +1,4 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Text
+from sqlalchemy import BigInteger, Boolean, Column, DateTime, ForeignKey, Index, Integer, String, Text, UniqueConstraint, func
 from database import Base
 from sqlalchemy.orm import relationship
 
@@ -9,13 +9,33 @@ class Products(Base):
     name = Column(String, index=True)
     description = Column(String, index=False)
     image_main = Column(Text, index=False, nullable=True)
-    images_secundary = Column(Text, index=False, nullable=True)
     active = Column(Boolean, index=True, nullable=False)
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
 
+    # Versions are bumped by hand (utils.versioning.touch) so that changes to
+    # images or categories count too; updates still check the loaded version.
+    __mapper_args__ = {"version_id_col": version, "version_id_generator": False}
+
+    # Link rows go away through ON DELETE CASCADE, without being loaded.
     categories = relationship(
         "Categories",
         secondary="categories_products",
-        back_populates="products"
+        back_populates="products",
+        passive_deletes=True,
+    )
+    images = relationship(
+        "Product_Images",
+        order_by="Product_Images.position",
+        back_populates="product",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
+    )
+    image_main_variants = relationship(
+        "Image_Variants",
+        primaryjoin="foreign(Image_Variants.source_path) == Products.image_main",
+        order_by="Image_Variants.id",
+        viewonly=True,
     )
 
 
@@ -26,23 +46,97 @@ class Categories(Base):
     name = Column(String, index=True, nullable=False)
     description = Column(String, nullable=True)
     image = Column(Text, nullable=True)
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+    __mapper_args__ = {"version_id_col": version, "version_id_generator": False}
 
     products = relationship(
         "Products",
         secondary="categories_products",
-        back_populates="categories"
+        back_populates="categories",
+        passive_deletes=True,
+    )
+    image_variants = relationship(
+        "Image_Variants",
+        primaryjoin="foreign(Image_Variants.source_path) == Categories.image",
+        order_by="Image_Variants.id",
+        viewonly=True,
     )
 
 class Categories_Products(Base):
     __tablename__ = 'categories_products'
 
+    product_id = Column(Integer, ForeignKey('products.id', ondelete='CASCADE'), primary_key=True)
+    category_id = Column(Integer, ForeignKey('categories.id', ondelete='CASCADE'), primary_key=True)
+
+    # The primary key serves product -> categories, this the other way round.
+    __table_args__ = (
+        Index('ix_categories_products_category_id_product_id', 'category_id', 'product_id'),
+    )
+
+class Product_Images(Base):
+    __tablename__ = 'product_images'
+
     id = Column(Integer, primary_key=True, index=True)
-    product_id = Column(Integer, ForeignKey('products.id'), nullable=False)
-    category_id = Column(Integer, ForeignKey('categories.id'), nullable=False)
+    product_id = Column(Integer, ForeignKey('products.id', ondelete='CASCADE'), nullable=False)
+    position = Column(Integer, nullable=False)
+    path = Column(Text, nullable=False)
+    size = Column(BigInteger, nullable=True)
+    sha256 = Column(String(64), nullable=True)
+    width = Column(Integer, nullable=True)
+    height = Column(Integer, nullable=True)
+    content_type = Column(String, nullable=True)
+
+    product = relationship("Products", back_populates="images")
+    variants = relationship(
+        "Image_Variants",
+        primaryjoin="foreign(Image_Variants.source_path) == Product_Images.path",
+        order_by="Image_Variants.id",
+        viewonly=True,
+    )
+
+    __table_args__ = (
+        Index('ix_product_images_product_id_position', 'product_id', 'position'),
+    )
 
 class Users(Base):
     __tablename__ = 'users'
 
     id = Column(Integer, primary_key=True, index=True)
     username = Column(String, unique=True)
-    hashed_password = Column(String)
\ No newline at end of file
+    hashed_password = Column(String)
+
+class Blobs(Base):
+    __tablename__ = 'blobs'
+
+    path = Column(String, primary_key=True)
+    sha256 = Column(String(64), nullable=True)
+    size = Column(BigInteger, nullable=True)
+    refcount = Column(Integer, nullable=False, default=0, server_default="0")
+
+    __table_args__ = (
+        Index(
+            'ix_blobs_unreferenced', 'path',
+            postgresql_where=refcount <= 0,
+            sqlite_where=refcount <= 0,
+        ),
+    )
+
+class Image_Variants(Base):
+    __tablename__ = 'image_variants'
+
+    # Variants belong to the stored file rather than to a product or category,
+    # so identical uploads share them and they go away with the blob.
+    id = Column(Integer, primary_key=True, index=True)
+    source_path = Column(String, nullable=False)
+    name = Column(String, nullable=False)
+    format = Column(String, nullable=False)
+    path = Column(String, nullable=False)
+    width = Column(Integer, nullable=True)
+    height = Column(Integer, nullable=True)
+    size = Column(BigInteger, nullable=True)
+
+    __table_args__ = (
+        UniqueConstraint('source_path', 'name', 'format', name='uq_image_variants_source_name_format'),
+    )
@@ -1,84 +1,177 @@
-from fastapi import APIRouter, Depends, UploadFile, File, Form, HTTPException, Path
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, BackgroundTasks, Depends, UploadFile, File, Form, HTTPException, Path, Query, Request, Response
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
 from typing import Optional, List
 import json
-from database import get_db
+from database import get_async_db
 import models
-from utils.file import save_uploaded_file, delete_uploaded_file
-from schemas.category import CategoryCreate, CategoryResponse
+from utils.file import release_files, store_uploaded_files
+from schemas.category import CategoryCreate, CategoryPage, CategoryResponse
 from auth.utils import get_current_user
+from utils.pagination import cursor_id, encode_cursor
+from utils.cache import cache, category_key, invalidate_categories, query_key
+from utils.images import generate_variants, purge_variants
+from utils import versioning
+from utils.responses import RawJSONResponse, dump_json
 router = APIRouter(
     prefix="/categories",
     tags=["Categories"]
 )
 
+def _category_query():
+    return select(models.Categories).options(selectinload(models.Categories.image_variants))
+
+async def _load_category(db: AsyncSession, category_id: int) -> Optional[models.Categories]:
+    return await db.scalar(
+        _category_query()
+        .where(models.Categories.id == category_id)
+        .execution_options(populate_existing=True)
+    )
+
+def warmup_queries():
+    """The statements behind the busiest reads, for database.warm_up."""
+    return [
+        _category_query().order_by(models.Categories.id).limit(51),
+        _category_query().where(models.Categories.id > 0).order_by(models.Categories.id).limit(51),
+        _category_query().where(models.Categories.id == 0),
+        select(models.Categories.version, models.Categories.updated_at).where(models.Categories.id == 0),
+    ]
+
+@router.get("/", response_model=CategoryPage)
+async def list_categories(
+    db: AsyncSession = Depends(get_async_db),
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = Query(None),
+    name_prefix: Optional[str] = Query(None, min_length=1),
+):
+    key = await query_key("categories", limit=limit, cursor=cursor, name_prefix=name_prefix)
+    body = await cache.get(key)
+    if body is not None:
+        return RawJSONResponse(body)
+
+    stmt = _category_query().order_by(models.Categories.id).limit(limit + 1)
+    if cursor:
+        stmt = stmt.where(models.Categories.id > cursor_id(cursor))
+    if name_prefix:
+        stmt = stmt.where(models.Categories.name.startswith(name_prefix, autoescape=True))
+
+    rows = (await db.scalars(stmt)).all()
+    next_cursor = encode_cursor({"id": rows[limit - 1].id}) if len(rows) > limit else None
+    body = dump_json(CategoryPage, {"items": rows[:limit], "next_cursor": next_cursor})
+    await cache.set(key, body)
+    return RawJSONResponse(body)
+
 @router.get("/{category_id}", response_model=CategoryResponse)
-async def get_categories(category_id: int, db: Session = Depends(get_db)):
-    result = db.query(models.Categories).filter(models.Categories.id == category_id).first()
-    if not result:
-        raise HTTPException(status_code=404, detail='category is not found')
-    return result
+async def get_categories(category_id: int, request: Request, db: AsyncSession = Depends(get_async_db)):
+    entry = await cache.get(category_key(category_id))
+    cached = versioning.read_cache_entry(entry) if entry is not None else None
+    if cached is None:
+        if versioning.is_conditional(request):
+            row = (await db.execute(
+                select(models.Categories.version, models.Categories.updated_at)
+                .where(models.Categories.id == category_id)
+            )).first()
+            if row:
+                headers = versioning.validators(category_id, *row)
+                if versioning.is_not_modified(request, headers):
+                    return versioning.not_modified(headers)
+
+        result = await db.scalar(_category_query().where(models.Categories.id == category_id))
+        if not result:
+            raise HTTPException(status_code=404, detail='category is not found')
+        body = dump_json(CategoryResponse, result)
+        headers = versioning.validators(category_id, result.version, result.updated_at)
+        await cache.set(category_key(category_id), versioning.cache_entry(headers, body))
+    else:
+        headers, body = cached
+
+    if versioning.is_not_modified(request, headers):
+        return versioning.not_modified(headers)
+    return RawJSONResponse(body, headers=headers)
 
 @router.post("/", response_model=CategoryResponse)
 async def create_categories(
+    background_tasks: BackgroundTasks,
     current_user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     name: str = Form(...),
     description: Optional[str] = Form(None),
     image: UploadFile = File(...)
 ):
-    image_main_file = save_uploaded_file(image)
+    stored = await store_uploaded_files([image], db)
 
     db_category = models.Categories(
         name=name,
         description=description,
-        image=image_main_file
+        image=stored[0].path
     )
     db.add(db_category)
-    db.commit()
-    db.refresh(db_category)
-    return db_category
+    await db.commit()
+    await invalidate_categories()
+    background_tasks.add_task(generate_variants, stored)
+    return await _load_category(db, db_category.id)
 
 
 
 @router.delete("/{category_id}", response_model=dict)
-def delete_product(category_id: int, db: Session = Depends(get_db), current_user: dict = Depends(get_current_user)):
-    category = db.query(models.Categories).filter(models.Categories.id == category_id).first()
+async def delete_product(category_id: int, request: Request, background_tasks: BackgroundTasks, db: AsyncSession = Depends(get_async_db), current_user: dict = Depends(get_current_user)):
+    category = await db.get(models.Categories, category_id)
     if not category:
         raise HTTPException(status_code=404, detail="Product not found")
-    
-    if category.image:
-        delete_uploaded_file(file=category.image)
 
-    db.delete(category)
-    db.commit()
+    await release_files(db, [category.image])
+
+    # The links go with the category (ON DELETE CASCADE). The products keep
+    # their version; their cached bodies are dropped all at once.
+    await db.delete(category)
+    await versioning.commit(db, request)
+    await invalidate_categories([category_id], products=True)
+    background_tasks.add_task(purge_variants, [category.image])
     return {"detail":"Category Eliminated"}
 
 
 @router.put("/{category_id}", response_model=CategoryResponse)
 async def update_product(
+    request: Request,
+    response: Response,
+    background_tasks: BackgroundTasks,
     current_user: dict = Depends(get_current_user),
     category_id: int = Path(...),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     name: Optional[str] = Form(None),
     description: Optional[str] = Form(None),
     image: Optional[UploadFile] = File(None),
 ):
-    category = db.query(models.Categories).filter(models.Categories.id == category_id).first()
-    if image:
-        if category.image:
-            delete_uploaded_file(file=category.image)
-
+    category = await db.scalar(select(models.Categories).where(models.Categories.id == category_id))
     if not category:
         raise HTTPException(status_code=404, detail="Category not found")
+    versioning.check_if_match(request, category_id, category.version)
+
+    released = []
+    if image:
+        stored = await store_uploaded_files([image], db)
+        released.append(category.image)
+        await release_files(db, released)
+        category.image = stored[0].path
+        background_tasks.add_task(generate_variants, stored)
 
+    # Products embed only the id and name of their categories.
+    renamed = name is not None and name != category.name
     if name is not None:
         category.name = name
     if description is not None:
         category.description = description
-    if image:
-        category.image = save_uploaded_file(image)
 
-    db.commit()
-    db.refresh(category)
-    return category
\ No newline at end of file
+    versioning.touch(category)
+    if renamed:
+        await versioning.bump_versions(db, models.Products, (
+            select(models.Categories_Products.product_id)
+            .where(models.Categories_Products.category_id == category_id)
+        ))
+    await versioning.commit(db, request)
+    await invalidate_categories([category_id], products=renamed)
+    background_tasks.add_task(purge_variants, released)
+    category = await _load_category(db, category_id)
+    response.headers.update(versioning.validators(category.id, category.version, category.updated_at))
+    return category
@@ -1,29 +1,187 @@
-from fastapi import APIRouter, Depends, UploadFile, File, Form, HTTPException, Path
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, BackgroundTasks, Depends, UploadFile, File, Form, HTTPException, Path, Query, Request, Response
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
 from typing import Optional, List
-import json
-from database import get_db
+from database import get_async_db
 import models
-from utils.file import save_uploaded_file, delete_uploaded_file
-from schemas.product import ProductResponse
+from utils.file import StoredFile, release_files, store_uploaded_files
+from schemas.product import ProductImportReport, ProductPage, ProductResponse
 from auth.utils import get_current_user
+from utils.pagination import cursor_id, decode_cursor, encode_cursor
+from utils.cache import cache, invalidate_products, product_key, query_key
+from utils.bulk_import import IMPORT_BATCH_SIZE, detect_format, import_products
+from utils.search import after_cursor, prefix_tsquery, search_clauses
+from utils.images import generate_variants, purge_variants
+from utils import versioning
+from utils.responses import RawJSONResponse, dump_json
 
 router = APIRouter(
     prefix="/products",
     tags=["Products"]
 )
 
+def _product_image(stored: StoredFile, position: int) -> models.Product_Images:
+    return models.Product_Images(
+        position=position,
+        path=stored.path,
+        size=stored.size,
+        sha256=stored.sha256,
+        width=stored.width,
+        height=stored.height,
+        content_type=stored.content_type,
+    )
+
+def _product_query():
+    return select(models.Products).options(
+        selectinload(models.Products.categories),
+        selectinload(models.Products.image_main_variants),
+        selectinload(models.Products.images).selectinload(models.Product_Images.variants),
+    )
+
+async def _load_product(db: AsyncSession, product_id: int) -> Optional[models.Products]:
+    return await db.scalar(
+        _product_query()
+        .where(models.Products.id == product_id)
+        .execution_options(populate_existing=True)
+    )
+
+def warmup_queries():
+    """The statements behind the busiest reads, for database.warm_up. The
+    listing returns rows so that the selectin loads are compiled too."""
+    return [
+        _product_query().order_by(models.Products.id).limit(51),
+        _product_query().where(models.Products.id > 0).order_by(models.Products.id).limit(51),
+        _product_query().where(models.Products.id == 0),
+        select(models.Products.version, models.Products.updated_at).where(models.Products.id == 0),
+    ]
+
+@router.get("/", response_model=ProductPage)
+async def list_products(
+    db: AsyncSession = Depends(get_async_db),
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = Query(None),
+    active: Optional[bool] = Query(None),
+    category_id: Optional[int] = Query(None),
+    name_prefix: Optional[str] = Query(None, min_length=1),
+):
+    key = await query_key(
+        "products", limit=limit, cursor=cursor, active=active,
+        category_id=category_id, name_prefix=name_prefix,
+    )
+    body = await cache.get(key)
+    if body is not None:
+        return RawJSONResponse(body)
+
+    stmt = _product_query().order_by(models.Products.id).limit(limit + 1)
+    if cursor:
+        stmt = stmt.where(models.Products.id > cursor_id(cursor))
+    if active is not None:
+        stmt = stmt.where(models.Products.active == active)
+    if category_id is not None:
+        stmt = stmt.where(models.Products.id.in_(
+            select(models.Categories_Products.product_id)
+            .where(models.Categories_Products.category_id == category_id)
+        ))
+    if name_prefix:
+        stmt = stmt.where(models.Products.name.startswith(name_prefix, autoescape=True))
+
+    rows = (await db.scalars(stmt)).all()
+    next_cursor = encode_cursor({"id": rows[limit - 1].id}) if len(rows) > limit else None
+    body = dump_json(ProductPage, {"items": rows[:limit], "next_cursor": next_cursor})
+    await cache.set(key, body)
+    return RawJSONResponse(body)
+
+@router.get("/search", response_model=ProductPage)
+async def search_products(
+    q: str = Query(..., min_length=1, max_length=200),
+    db: AsyncSession = Depends(get_async_db),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = Query(None),
+    active: Optional[bool] = Query(None),
+    category_id: Optional[int] = Query(None),
+):
+    if db.bind.dialect.name != "postgresql":
+        raise HTTPException(status_code=501, detail="Search requires PostgreSQL")
+    tsquery = prefix_tsquery(q)
+    if tsquery is None:
+        return {"items": [], "next_cursor": None}
+
+    key = await query_key(
+        "products", search=q, limit=limit, cursor=cursor,
+        active=active, category_id=category_id,
+    )
+    body = await cache.get(key)
+    if body is not None:
+        return RawJSONResponse(body)
+
+    matches, rank = search_clauses(q, tsquery)
+    stmt = (
+        _product_query()
+        .add_columns(rank.label("rank"))
+        .where(matches)
+        .order_by(rank.desc(), models.Products.id.desc())
+        .limit(limit + 1)
+    )
+    if cursor:
+        values = decode_cursor(cursor)
+        try:
+            stmt = stmt.where(after_cursor(rank, float(values["rank"]), int(values["id"])))
+        except (KeyError, TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    if active is not None:
+        stmt = stmt.where(models.Products.active == active)
+    if category_id is not None:
+        stmt = stmt.where(models.Products.id.in_(
+            select(models.Categories_Products.product_id)
+            .where(models.Categories_Products.category_id == category_id)
+        ))
+
+    rows = (await db.execute(stmt)).all()
+    next_cursor = None
+    if len(rows) > limit:
+        last, last_rank = rows[limit - 1]
+        next_cursor = encode_cursor({"rank": last_rank, "id": last.id})
+    body = dump_json(ProductPage, {"items": [row[0] for row in rows[:limit]], "next_cursor": next_cursor})
+    await cache.set(key, body)
+    return RawJSONResponse(body)
+
 @router.get("/{product_id}", response_model=ProductResponse)
-async def get_products(product_id: int, db: Session = Depends(get_db)):
-    result = db.query(models.Products).filter(models.Products.id == product_id).first()
-    if not result:
-        raise HTTPException(status_code=404, detail='product is not found')
-    return result
+async def get_products(product_id: int, request: Request, db: AsyncSession = Depends(get_async_db)):
+    key = await product_key(product_id)
+    entry = await cache.get(key)
+    cached = versioning.read_cache_entry(entry) if entry is not None else None
+    if cached is None:
+        if versioning.is_conditional(request):
+            # Answer a revalidation from the version alone, without loading
+            # the images and categories.
+            row = (await db.execute(
+                select(models.Products.version, models.Products.updated_at)
+                .where(models.Products.id == product_id)
+            )).first()
+            if row:
+                headers = versioning.validators(product_id, *row)
+                if versioning.is_not_modified(request, headers):
+                    return versioning.not_modified(headers)
+
+        result = await db.scalar(_product_query().where(models.Products.id == product_id))
+        if not result:
+            raise HTTPException(status_code=404, detail='product is not found')
+        body = dump_json(ProductResponse, result)
+        headers = versioning.validators(product_id, result.version, result.updated_at)
+        await cache.set(key, versioning.cache_entry(headers, body))
+    else:
+        headers, body = cached
+
+    if versioning.is_not_modified(request, headers):
+        return versioning.not_modified(headers)
+    return RawJSONResponse(body, headers=headers)
 
 @router.post("/", response_model=ProductResponse)
 async def create_product(
+    background_tasks: BackgroundTasks,
     current_user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     name: str = Form(...),
     description: Optional[str] = Form(None),
     image_main: UploadFile = File(...),
@@ -32,15 +190,13 @@ async def create_product(
     category_ids: Optional[str] = Form(None)
 ):
 
-    image_main_path = save_uploaded_file(image_main)
-    image_paths = [save_uploaded_file(img) for img in images_secundary]
-
+    stored = await store_uploaded_files([image_main, *images_secundary], db)
 
     db_product = models.Products(
         name=name,
         description=description,
-        image_main=image_main_path,
-        images_secundary=json.dumps(image_paths),
+        image_main=stored[0].path,
+        images=[_product_image(f, i) for i, f in enumerate(stored[1:])],
         active=active
     )
 
@@ -50,37 +206,54 @@ async def create_product(
         except:
             raise HTTPException(status_code=400, detail="category_ids debe ser separados por coma, como: 1,2")
 
-        categories = db.query(models.Categories).filter(models.Categories.id.in_(category_ids)).all()
-        db_product.categories = categories
+        categories = await db.scalars(select(models.Categories).where(models.Categories.id.in_(category_ids)))
+        db_product.categories = categories.all()
 
     db.add(db_product)
-    db.commit()
-    db.refresh(db_product)
-    return db_product
+    await db.commit()
+    await invalidate_products()
+    background_tasks.add_task(generate_variants, stored)
+    return await _load_product(db, db_product.id)
+
+@router.post("/import", response_model=ProductImportReport)
+async def import_product_catalog(
+    current_user: dict = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+    file: UploadFile = File(...),
+    format: Optional[str] = Form(None, pattern="^(csv|ndjson)$"),
+    batch_size: int = Form(IMPORT_BATCH_SIZE, ge=1, le=10000),
+):
+    fmt = format or detect_format(file.filename, file.content_type)
+    await file.seek(0)
+    return await import_products(db, file.file, fmt, batch_size)
 
 @router.delete("/{product_id}", response_model=dict)
-def delete_product(product_id: int, db: Session = Depends(get_db), current_user: dict = Depends(get_current_user)):
-    product = db.query(models.Products).filter(models.Products.id == product_id).first()
+async def delete_product(product_id: int, request: Request, background_tasks: BackgroundTasks, db: AsyncSession = Depends(get_async_db), current_user: dict = Depends(get_current_user)):
+    product = await db.get(models.Products, product_id)
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
-    if product.image_main:
-        delete_uploaded_file(file=product.image_main)
-    if product.images_secundary:
-        try:
-            image_list = json.loads(product.images_secundary)
-            delete_uploaded_file(multiple_file=image_list)
-        except json.JSONDecodeError:
-            pass
+    # Images and category links are deleted by the database (ON DELETE
+    # CASCADE); only their paths are needed here.
+    image_paths = (await db.scalars(
+        select(models.Product_Images.path).where(models.Product_Images.product_id == product_id)
+    )).all()
+    released = [product.image_main, *image_paths]
+    await release_files(db, released)
 
-    db.delete(product)
-    db.commit()
+    await db.delete(product)
+    await versioning.commit(db, request)
+    await invalidate_products([product_id])
+    background_tasks.add_task(purge_variants, released)
     return {"detail":"Product Eliminated"}
 
 @router.put("/{product_id}", response_model=ProductResponse)
 async def update_product(
+    request: Request,
+    response: Response,
+    background_tasks: BackgroundTasks,
     current_user: dict = Depends(get_current_user),
     product_id: int = Path(...),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     name: Optional[str] = Form(None),
     description: Optional[str] = Form(None),
     image_main: Optional[UploadFile] = File(None),
@@ -88,20 +261,23 @@ async def update_product(
     active: Optional[bool] = Form(None),
     category_ids: Optional[str] = Form(None)
 ):
-    product = db.query(models.Products).filter(models.Products.id == product_id).first()
+    product = await db.scalar(_product_query().where(models.Products.id == product_id))
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
-    
+    versioning.check_if_match(request, product_id, product.version)
+
+    new_uploads = ([image_main] if image_main else []) + (images_secundary or [])
+    stored = await store_uploaded_files(new_uploads, db)
+    background_tasks.add_task(generate_variants, list(stored))
+
+    released = []
     if image_main:
-        if product.image_main:
-            delete_uploaded_file(file=product.image_main)
+        released.append(product.image_main)
+        product.image_main = stored.pop(0).path
     if images_secundary:
-        if product.images_secundary:
-            try:
-                image_list = json.loads(product.images_secundary)
-                delete_uploaded_file(multiple_file=image_list)
-            except json.JSONDecodeError:
-                pass
+        released.extend(image.path for image in product.images)
+        product.images = [_product_image(f, i) for i, f in enumerate(stored)]
+    await release_files(db, released)
 
     if name is not None:
         product.name = name
@@ -109,11 +285,6 @@ async def update_product(
         product.description = description
     if active is not None:
         product.active = active
-    if image_main:
-        product.image_main = save_uploaded_file(image_main)
-    if images_secundary:
-        paths = [save_uploaded_file(img) for img in images_secundary]
-        product.images_secundary = json.dumps(paths)
 
     if category_ids:
         try:
@@ -121,11 +292,61 @@ async def update_product(
         except:
             raise HTTPException(status_code=400, detail="category_ids must be comma separated: 1,2,3")
 
-        categories = db.query(models.Categories).filter(models.Categories.id.in_(ids)).all()
-        product.categories = categories
+        categories = await db.scalars(select(models.Categories).where(models.Categories.id.in_(ids)))
+        product.categories = categories.all()
     else:
         product.categories = []
 
-    db.commit()
-    db.refresh(product)
+    versioning.touch(product)
+    await versioning.commit(db, request)
+    await invalidate_products([product_id])
+    background_tasks.add_task(purge_variants, released)
+    product = await _load_product(db, product.id)
+    response.headers.update(versioning.validators(product.id, product.version, product.updated_at))
     return product
+
+@router.post("/{product_id}/images", response_model=ProductResponse)
+async def add_product_images(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    current_user: dict = Depends(get_current_user),
+    product_id: int = Path(...),
+    db: AsyncSession = Depends(get_async_db),
+    images: List[UploadFile] = File(...),
+):
+    product = await db.scalar(_product_query().where(models.Products.id == product_id))
+    if not product:
+        raise HTTPException(status_code=404, detail="Product not found")
+
+    stored = await store_uploaded_files(images, db)
+    start = max((image.position for image in product.images), default=-1) + 1
+    product.images.extend(_product_image(f, start + i) for i, f in enumerate(stored))
+
+    versioning.touch(product)
+    await versioning.commit(db, request)
+    await invalidate_products([product_id])
+    background_tasks.add_task(generate_variants, stored)
+    return await _load_product(db, product_id)
+
+@router.delete("/{product_id}/images/{image_id}", response_model=ProductResponse)
+async def delete_product_image(
+    background_tasks: BackgroundTasks,
+    current_user: dict = Depends(get_current_user),
+    product_id: int = Path(...),
+    image_id: int = Path(...),
+    db: AsyncSession = Depends(get_async_db),
+):
+    image = await db.scalar(
+        select(models.Product_Images)
+        .where(models.Product_Images.id == image_id, models.Product_Images.product_id == product_id)
+    )
+    if not image:
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    await release_files(db, [image.path])
+    await db.delete(image)
+    await versioning.bump_versions(db, models.Products, [product_id])
+    await db.commit()
+    await invalidate_products([product_id])
+    background_tasks.add_task(purge_variants, [image.path])
+    return await _load_product(db, product_id)
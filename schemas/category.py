@@ -1,5 +1,7 @@
+from datetime import datetime
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
+from schemas.image import ImageVariantResponse
 
 class CategoryBase(BaseModel):
     name: str
@@ -11,3 +13,14 @@ class CategoryCreate(CategoryBase):
 
 class CategoryResponse(CategoryBase):
     id: int
+    version: int = 1
+    updated_at: Optional[datetime] = None
+    image_variants: List[ImageVariantResponse] = []
+
+class CategorySummary(BaseModel):
+    id: int
+    name: str
+
+class CategoryPage(BaseModel):
+    items: List[CategoryResponse]
+    next_cursor: Optional[str] = None
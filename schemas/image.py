@@ -0,0 +1,16 @@
+from pydantic import BaseModel, computed_field
+from typing import Optional
+from utils.file import public_url
+
+class ImageVariantResponse(BaseModel):
+    name: str
+    format: str
+    path: str
+    width: Optional[int] = None
+    height: Optional[int] = None
+    size: Optional[int] = None
+
+    @computed_field
+    @property
+    def url(self) -> str:
+        return public_url(self.path)
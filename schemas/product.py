@@ -1,15 +1,61 @@
-from pydantic import BaseModel
-from typing import List, Optional
+from datetime import datetime
+from pydantic import BaseModel, Field, field_validator
+from typing import List, Optional, Union
+from schemas.category import CategorySummary
+from schemas.image import ImageVariantResponse
 
 class ProductBase(BaseModel):
     name: str
     description: Optional[str] = None
     image_main: Optional[str] = None
-    images_secundary: str
     active: bool
 
 class ProductCreate(ProductBase):
     category_ids: Optional[List[int]] = None
 
+class ProductImageResponse(BaseModel):
+    id: int
+    position: int
+    path: str
+    size: Optional[int] = None
+    sha256: Optional[str] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+    content_type: Optional[str] = None
+    variants: List[ImageVariantResponse] = []
+
 class ProductResponse(ProductBase):
     id: int
+    version: int = 1
+    updated_at: Optional[datetime] = None
+    image_main_variants: List[ImageVariantResponse] = []
+    images: List[ProductImageResponse] = []
+    categories: List[CategorySummary] = []
+
+class ProductPage(BaseModel):
+    items: List[ProductResponse]
+    next_cursor: Optional[str] = None
+
+class ProductImportRow(BaseModel):
+    name: str = Field(min_length=1)
+    description: Optional[str] = None
+    active: bool = True
+    categories: List[Union[int, str]] = []
+
+    @field_validator("categories", mode="before")
+    @classmethod
+    def split_categories(cls, value):
+        if value is None or value == "":
+            return []
+        if isinstance(value, str):
+            value = value.split("|")
+        return [int(v) if isinstance(v, str) and v.strip().isdigit() else v for v in value]
+
+class ProductImportError(BaseModel):
+    row: int
+    error: str
+
+class ProductImportReport(BaseModel):
+    inserted: int = 0
+    failed: int = 0
+    errors: List[ProductImportError] = []
@@ -0,0 +1,150 @@
+"""Production server: several uvicorn workers on uvloop and httptools.
+
+    python serve.py
+    SERVER_WORKERS=4 DB_CONNECTION_BUDGET=80 python serve.py --port 8000
+
+The worker count defaults to the CPUs the container may use. Each worker
+drains open requests for up to SERVER_GRACEFUL_TIMEOUT seconds on SIGTERM
+and is replaced after about SERVER_MAX_REQUESTS requests.
+"""
+import argparse
+import logging
+import math
+import os
+import random
+import shutil
+import tempfile
+
+import uvicorn
+from uvicorn.supervisors import Multiprocess
+
+from utils.cache import CACHE_BACKEND
+from utils.ratelimit import RATE_LIMIT_BACKEND, RATE_LIMIT_ENABLED
+
+logger = logging.getLogger("uvicorn.error")
+
+SERVER_HOST = os.getenv("SERVER_HOST", "0.0.0.0")
+SERVER_PORT = int(os.getenv("SERVER_PORT", "8000"))
+SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", "0"))
+SERVER_LOOP = os.getenv("SERVER_LOOP", "uvloop")
+SERVER_HTTP = os.getenv("SERVER_HTTP", "httptools")
+SERVER_GRACEFUL_TIMEOUT = int(os.getenv("SERVER_GRACEFUL_TIMEOUT", "30"))
+SERVER_KEEPALIVE = int(os.getenv("SERVER_KEEPALIVE", "5"))
+SERVER_BACKLOG = int(os.getenv("SERVER_BACKLOG", "2048"))
+# 0 never recycles workers. Each worker adds up to SERVER_MAX_REQUESTS_JITTER
+# so that they are not all replaced at once.
+SERVER_MAX_REQUESTS = int(os.getenv("SERVER_MAX_REQUESTS", "0"))
+SERVER_MAX_REQUESTS_JITTER = int(os.getenv("SERVER_MAX_REQUESTS_JITTER", "0"))
+# Connections all workers together may open to the database; 0 keeps
+# DB_POOL_SIZE and DB_MAX_OVERFLOW as they are, per worker.
+DB_CONNECTION_BUDGET = int(os.getenv("DB_CONNECTION_BUDGET", "0"))
+
+
+def available_cpus() -> int:
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    # A container's CPU limit is a cgroup quota, not a set of cores.
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cpus = min(cpus, math.ceil(int(quota) / int(period)))
+    except (OSError, ValueError):
+        pass
+    return max(1, cpus)
+
+
+def pool_sizes(budget: int, workers: int):
+    """Split ``budget`` connections over ``workers``: two thirds of each
+    share kept in the pool, the rest as overflow."""
+    share = budget // workers
+    if share < 1:
+        raise SystemExit(f"DB_CONNECTION_BUDGET={budget} is less than one connection per worker ({workers} workers)")
+    pool_size = max(1, share * 2 // 3)
+    return pool_size, share - pool_size
+
+
+class _Server(uvicorn.Server):
+    def __init__(self, config: uvicorn.Config, max_requests_jitter: int = 0):
+        super().__init__(config)
+        self.max_requests_jitter = max_requests_jitter
+
+    def run(self, sockets=None):
+        # Runs in each worker process, on its own copy of the config.
+        if self.config.limit_max_requests and self.max_requests_jitter:
+            self.config.limit_max_requests += random.randint(0, self.max_requests_jitter)
+        return super().run(sockets=sockets)
+
+
+def main(args):
+    workers = args.workers or available_cpus()
+    # Every worker would keep serving, and answering 304 for, what it cached
+    # before another worker handled a write. A worker count derived from
+    # the CPUs falls back to one, so that the image starts anywhere.
+    single_cache = workers > 1 and CACHE_BACKEND != "redis"
+    if single_cache and args.workers:
+        raise SystemExit(f"{workers} workers need CACHE_BACKEND=redis; use SERVER_WORKERS=1 with the {CACHE_BACKEND} cache")
+    if single_cache:
+        cpus, workers = workers, 1
+
+    # Workers read these when they import the app.
+    if DB_CONNECTION_BUDGET:
+        pool_size, max_overflow = pool_sizes(DB_CONNECTION_BUDGET, workers)
+        os.environ["DB_POOL_SIZE"] = str(pool_size)
+        os.environ["DB_MAX_OVERFLOW"] = str(max_overflow)
+    # Every worker would walk the whole upload directory, so several leave
+    # the orphan sweep to `python gc_uploads.py --sweep`. Collecting released
+    # files keeps running in all of them.
+    disable_sweep = workers > 1 and os.getenv("UPLOAD_SWEEP_INTERVAL") != "0"
+    if disable_sweep:
+        os.environ["UPLOAD_SWEEP_INTERVAL"] = "0"
+    multiproc_dir = None
+    if workers > 1 and "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        # Lets /metrics add up every worker instead of the one that answers.
+        multiproc_dir = tempfile.mkdtemp(prefix="prometheus-")
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = multiproc_dir
+
+    config = uvicorn.Config(
+        "main:app",
+        host=args.host,
+        port=args.port,
+        workers=workers,
+        loop=SERVER_LOOP,
+        http=SERVER_HTTP,
+        backlog=SERVER_BACKLOG,
+        timeout_keep_alive=SERVER_KEEPALIVE,
+        timeout_graceful_shutdown=SERVER_GRACEFUL_TIMEOUT,
+        limit_max_requests=SERVER_MAX_REQUESTS or None,
+        access_log=args.access_log,
+    )
+    server = _Server(config, SERVER_MAX_REQUESTS_JITTER)
+    logger.info(
+        "Starting %d workers (loop=%s, http=%s, db pool=%s+%s per worker)",
+        workers, SERVER_LOOP, SERVER_HTTP,
+        os.getenv("DB_POOL_SIZE", "5"), os.getenv("DB_MAX_OVERFLOW", "10"),
+    )
+    if single_cache:
+        logger.warning("Running 1 worker for %d CPUs: several workers need CACHE_BACKEND=redis and REDIS_URL", cpus)
+    if workers > 1 and RATE_LIMIT_ENABLED and RATE_LIMIT_BACKEND != "redis":
+        logger.warning("Rate limits are per worker; %d workers allow %d times the configured rates", workers, workers)
+    if disable_sweep:
+        logger.info("Orphan sweeps are off in the workers; run `python gc_uploads.py --sweep` periodically")
+    try:
+        if workers > 1:
+            Multiprocess(config, target=server.run, sockets=[config.bind_socket()]).run()
+        else:
+            server.run()
+    finally:
+        if multiproc_dir:
+            shutil.rmtree(multiproc_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--workers", type=int, default=SERVER_WORKERS, help="0 uses one per available CPU")
+    parser.add_argument("--access-log", action="store_true")
+    main(parser.parse_args())
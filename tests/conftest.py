@@ -0,0 +1,55 @@
+import os
+import subprocess
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_tmp = tempfile.mkdtemp(prefix="api-tests-")
+# Read by the app's modules on import.
+os.environ["URL_DATABASE"] = f"sqlite:///{os.path.join(_tmp, 'app.db')}"
+os.environ.pop("URL_DATABASE_ASYNC", None)
+os.environ.setdefault("SECRET_KEY", "test-secret")
+os.environ.setdefault("ALGORITHM", "HS256")
+os.environ["UPLOAD_DIR"] = os.path.join(_tmp, "uploads")
+os.environ["UPLOAD_GC_INTERVAL"] = "0"
+os.environ["RATE_LIMIT_ENABLED"] = "false"
+sys.path.insert(0, ROOT)
+
+
+def _seed(products: int = 20):
+    from sqlalchemy import create_engine, insert
+    import models
+
+    engine = create_engine(os.environ["URL_DATABASE"])
+    with engine.begin() as conn:
+        conn.execute(insert(models.Categories), [
+            {"name": f"Category {i}", "image": f"uploads/c{i}.png"} for i in range(3)
+        ])
+        conn.execute(insert(models.Products), [
+            {"name": f"Product {i}", "image_main": f"uploads/p{i}.png", "active": True} for i in range(products)
+        ])
+        conn.execute(insert(models.Categories_Products), [
+            {"product_id": p, "category_id": c} for p in range(1, products + 1) for c in (1, 2)
+        ])
+        conn.execute(insert(models.Product_Images), [
+            {"product_id": p, "position": i, "path": f"uploads/p{p}-{i}.png"} for p in range(1, products + 1) for i in range(2)
+        ])
+        conn.execute(insert(models.Image_Variants), [
+            {"source_path": path, "name": "thumb", "format": "webp", "path": f"{path}.webp"}
+            for path in [f"uploads/p{i}.png" for i in range(products)]
+            + [f"uploads/p{p}-{i}.png" for p in range(1, products + 1) for i in range(2)]
+        ])
+    engine.dispose()
+
+
+@pytest.fixture(scope="session")
+def client():
+    subprocess.run([sys.executable, "-m", "alembic", "upgrade", "head"], cwd=ROOT, env=os.environ, check=True, capture_output=True)
+    _seed()
+    from fastapi.testclient import TestClient
+    import main
+
+    with TestClient(main.app) as client:
+        yield client
@@ -0,0 +1,114 @@
+"""The read-through cache against both backends: MemoryCache, and
+RedisCache on fakeredis standing in for a Redis server."""
+import anyio
+import fakeredis
+import pytest
+
+from utils import cache as cache_module
+from utils.cache import (
+    MemoryCache, RedisCache, category_key, invalidate_categories, invalidate_products, product_key, query_key,
+)
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture(params=["memory", "redis"])
+def cache(request, monkeypatch):
+    if request.param == "redis":
+        backend = RedisCache(fakeredis.FakeAsyncRedis(), ttl=60)
+    else:
+        backend = MemoryCache(ttl=60)
+    # The key helpers and invalidation go through the module's instance.
+    monkeypatch.setattr(cache_module, "cache", backend)
+    return backend
+
+
+@pytest.mark.anyio
+async def test_get_set_counts_hits_and_misses(cache):
+    assert await cache.get("a") is None
+    await cache.set("a", "1")
+    assert await cache.get("a") == "1"
+    assert cache.stats() == {"hits": 1, "misses": 1, "evictions": 0}
+
+
+@pytest.mark.anyio
+async def test_invalidate_products_deletes_their_keys(cache):
+    await cache.set(await product_key(1), "one")
+    await cache.set(await product_key(2), "two")
+    await invalidate_products([1])
+    assert await cache.get(await product_key(1)) is None
+    assert await cache.get(await product_key(2)) == "two"
+
+
+@pytest.mark.anyio
+async def test_write_bumps_the_list_namespace(cache):
+    key = await query_key("products", limit=50, cursor=None)
+    await cache.set(key, "page")
+    assert await query_key("products", limit=50, cursor=None) == key
+
+    await invalidate_products()
+    new_key = await query_key("products", limit=50, cursor=None)
+    assert new_key != key
+    assert await cache.get(new_key) is None
+
+
+@pytest.mark.anyio
+async def test_category_change_keeps_products(cache):
+    await cache.set(category_key(1), "category")
+    await cache.set(await product_key(1), "product")
+    await invalidate_categories([1])
+    assert await cache.get(category_key(1)) is None
+    assert await cache.get(await product_key(1)) == "product"
+
+
+@pytest.mark.anyio
+async def test_category_rename_drops_every_product(cache):
+    await cache.set(await product_key(1), "product")
+    await cache.set(await product_key(2), "product")
+    products_page = await query_key("products", limit=50)
+    await cache.set(products_page, "page")
+
+    await invalidate_categories([1], products=True)
+    assert await cache.get(await product_key(1)) is None
+    assert await cache.get(await product_key(2)) is None
+    assert await query_key("products", limit=50) != products_page
+
+
+@pytest.mark.anyio
+async def test_entries_expire(cache):
+    await cache.set("a", "1", ttl=1)
+    await cache.set("b", "2")
+    await anyio.sleep(1.1)
+    assert await cache.get("a") is None
+    assert await cache.get("b") == "2"
+
+
+@pytest.mark.anyio
+async def test_memory_cache_evicts_least_recently_used():
+    cache = MemoryCache(ttl=60, max_entries=2)
+    await cache.set("a", "1")
+    await cache.set("b", "2")
+    await cache.get("a")
+    await cache.set("c", "3")
+    assert await cache.get("b") is None
+    assert await cache.get("a") == "1"
+    assert await cache.get("c") == "3"
+    assert cache.stats()["evictions"] == 1
+
+
+class _Down:
+    async def get(self, *args, **kwargs):
+        raise ConnectionError("down")
+
+    set = delete = get
+
+
+@pytest.mark.anyio
+async def test_redis_errors_are_misses():
+    cache = RedisCache(_Down())
+    await cache.set("a", "1")
+    assert await cache.get("a") is None
+    await cache.delete(["a"])
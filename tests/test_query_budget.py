@@ -0,0 +1,30 @@
+"""Query budgets of the read endpoints: one statement per relationship,
+however many rows are returned. A lazy load per row (N+1) breaks them."""
+import pytest
+
+from utils.cache import invalidate_products
+from utils.profiler import assert_max_queries
+
+# The products, then selectin loads of categories, main image variants,
+# secondary images and their variants.
+PRODUCT_QUERIES = 5
+
+
+@pytest.fixture(autouse=True)
+def cold_cache(client):
+    # A cached response runs no queries at all.
+    client.portal.call(invalidate_products)
+
+
+def test_list_products_query_budget(client):
+    response = assert_max_queries(client, "GET", "/products/?limit=20", PRODUCT_QUERIES)
+    assert response.status_code == 200
+    items = response.json()["items"]
+    assert len(items) == 20
+    assert all(len(item["images"]) == 2 and item["categories"] for item in items)
+
+
+def test_get_product_query_budget(client):
+    response = assert_max_queries(client, "GET", "/products/1", PRODUCT_QUERIES)
+    assert response.status_code == 200
+    assert len(response.json()["images"]) == 2
@@ -0,0 +1,149 @@
+import csv
+import io
+import json
+import os
+from itertools import islice
+from typing import IO, Iterator, List, Optional, Tuple, Union
+from pydantic import ValidationError
+from sqlalchemy import insert, select
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+import models
+from schemas.product import ProductImportError, ProductImportReport, ProductImportRow
+from utils.cache import invalidate_products
+
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "1000"))
+IMPORT_MAX_ERRORS = int(os.getenv("IMPORT_MAX_ERRORS", "1000"))
+
+
+def _add_error(report: ProductImportReport, row: int, error: str):
+    report.failed += 1
+    if len(report.errors) < IMPORT_MAX_ERRORS:
+        report.errors.append(ProductImportError(row=row, error=error))
+
+
+def detect_format(filename: Optional[str], content_type: Optional[str] = None) -> str:
+    if (filename or "").lower().endswith(".csv") or content_type == "text/csv":
+        return "csv"
+    return "ndjson"
+
+
+def iter_records(stream: IO[bytes], fmt: str) -> Iterator[Tuple[int, Union[dict, Exception]]]:
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    if fmt == "csv":
+        for number, record in enumerate(csv.DictReader(text), start=1):
+            yield number, {k: v for k, v in record.items() if k is not None and v != ""}
+        return
+
+    for number, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line)
+        except json.JSONDecodeError as e:
+            yield number, e
+
+
+class _CategoryResolver:
+    def __init__(self):
+        self.by_name = {}
+        self.known_ids = set()
+
+    async def load(self, db: AsyncSession, rows: List[ProductImportRow]):
+        names = {c for r in rows for c in r.categories if isinstance(c, str)} - self.by_name.keys()
+        ids = {c for r in rows for c in r.categories if isinstance(c, int)} - self.known_ids
+        if names:
+            result = await db.execute(
+                select(models.Categories.name, models.Categories.id)
+                .where(models.Categories.name.in_(names))
+                .order_by(models.Categories.id.desc())
+            )
+            # Names are not unique; ordering by id desc leaves the oldest one.
+            self.by_name.update(dict(result.all()))
+        if ids:
+            result = await db.scalars(select(models.Categories.id).where(models.Categories.id.in_(ids)))
+            self.known_ids.update(result.all())
+
+    def resolve(self, row: ProductImportRow) -> List[int]:
+        ids = []
+        for ref in row.categories:
+            category_id = self.by_name.get(ref) if isinstance(ref, str) else (ref if ref in self.known_ids else None)
+            if category_id is None:
+                raise ValueError(f"unknown category {ref!r}")
+            if category_id not in ids:
+                ids.append(category_id)
+        return ids
+
+
+def _product_values(row: ProductImportRow) -> dict:
+    return {"name": row.name, "description": row.description, "active": row.active}
+
+
+async def _insert(db: AsyncSession, items: List[Tuple[int, ProductImportRow, List[int]]]):
+    product_ids = (await db.scalars(
+        insert(models.Products).returning(models.Products.id, sort_by_parameter_order=True),
+        [_product_values(row) for _, row, _ in items],
+    )).all()
+    links = [
+        {"product_id": product_id, "category_id": category_id}
+        for product_id, (_, _, category_ids) in zip(product_ids, items)
+        for category_id in category_ids
+    ]
+    if links:
+        await db.execute(insert(models.Categories_Products), links)
+
+
+async def _import_batch(db: AsyncSession, records, resolver: _CategoryResolver, report: ProductImportReport):
+    rows = []
+    for number, record in records:
+        if isinstance(record, Exception):
+            _add_error(report, number, f"invalid JSON: {record}")
+            continue
+        try:
+            rows.append((number, ProductImportRow.model_validate(record)))
+        except ValidationError as e:
+            _add_error(report, number, "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors()))
+
+    await resolver.load(db, [row for _, row in rows])
+    items = []
+    for number, row in rows:
+        try:
+            items.append((number, row, resolver.resolve(row)))
+        except ValueError as e:
+            _add_error(report, number, str(e))
+    if not items:
+        return
+
+    try:
+        await _insert(db, items)
+        await db.commit()
+        report.inserted += len(items)
+        return
+    except DBAPIError:
+        await db.rollback()
+
+    # Retry row by row so that one bad row does not reject the whole batch.
+    for item in items:
+        try:
+            async with db.begin_nested():
+                await _insert(db, [item])
+            report.inserted += 1
+        except DBAPIError as e:
+            _add_error(report, item[0], str(e.orig))
+    await db.commit()
+
+
+async def import_products(db: AsyncSession, stream: IO[bytes], fmt: str, batch_size: int = IMPORT_BATCH_SIZE) -> ProductImportReport:
+    report = ProductImportReport()
+    resolver = _CategoryResolver()
+    records = iter_records(stream, fmt)
+    try:
+        while batch := await run_in_threadpool(lambda: list(islice(records, batch_size))):
+            await _import_batch(db, batch, resolver, report)
+    except (csv.Error, UnicodeDecodeError) as e:
+        _add_error(report, 0, f"could not parse input: {e}")
+    finally:
+        if report.inserted:
+            await invalidate_products()
+    return report
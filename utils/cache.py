@@ -0,0 +1,175 @@
+import hashlib
+import json
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")
+CACHE_TTL = int(os.getenv("CACHE_TTL", "60"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+
+class CacheBackend:
+    def __init__(self, ttl: int = CACHE_TTL):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    async def _get(self, key: str) -> Optional[str]:
+        raise NotImplementedError
+
+    async def _set(self, key: str, value: str, ttl: Optional[int]):
+        raise NotImplementedError
+
+    async def _delete(self, keys: list):
+        raise NotImplementedError
+
+    async def get(self, key: str) -> Optional[str]:
+        value = await self._get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def set(self, key: str, value: str, ttl: Optional[int] = None):
+        await self._set(key, value, self.ttl if ttl is None else ttl)
+
+    async def delete(self, keys: Iterable[str]):
+        keys = list(keys)
+        if keys:
+            await self._delete(keys)
+
+    async def get_json(self, key: str) -> Any:
+        value = await self.get(key)
+        return None if value is None else json.loads(value)
+
+    async def set_json(self, key: str, value: Any, ttl: Optional[int] = None):
+        await self.set(key, json.dumps(value, separators=(",", ":")), ttl)
+
+    async def namespace(self, name: str) -> str:
+        key = f"ns:{name}"
+        token = await self._get(key)
+        if token is None:
+            token = uuid.uuid4().hex
+            await self._set(key, token, None)
+        return token
+
+    async def invalidate_namespace(self, name: str):
+        await self._set(f"ns:{name}", uuid.uuid4().hex, None)
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+class MemoryCache(CacheBackend):
+    def __init__(self, ttl: int = CACHE_TTL, max_entries: int = CACHE_MAX_ENTRIES):
+        super().__init__(ttl)
+        self.max_entries = max_entries
+        self._entries: OrderedDict = OrderedDict()
+
+    async def _get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def _set(self, key, value, ttl):
+        expires_at = time.monotonic() + ttl if ttl else None
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def _delete(self, keys):
+        for key in keys:
+            self._entries.pop(key, None)
+
+
+class RedisCache(CacheBackend):
+    """Cache stored in any server speaking the Redis protocol.
+
+    ``client`` is a ``redis.asyncio`` client or anything exposing the same
+    ``get``/``set``/``delete`` coroutines. Errors are logged and treated as
+    misses so the API keeps serving from the database if Redis is down.
+    """
+
+    def __init__(self, client, ttl: int = CACHE_TTL, prefix: str = "api:"):
+        super().__init__(ttl)
+        self.client = client
+        self.prefix = prefix
+
+    async def _get(self, key):
+        try:
+            value = await self.client.get(self.prefix + key)
+        except Exception:
+            logger.warning("cache get failed for %s", key, exc_info=True)
+            return None
+        return value.decode() if isinstance(value, bytes) else value
+
+    async def _set(self, key, value, ttl):
+        try:
+            await self.client.set(self.prefix + key, value, ex=ttl or None)
+        except Exception:
+            logger.warning("cache set failed for %s", key, exc_info=True)
+
+    async def _delete(self, keys):
+        try:
+            await self.client.delete(*(self.prefix + k for k in keys))
+        except Exception:
+            logger.warning("cache delete failed for %s", keys, exc_info=True)
+
+
+def build_cache(backend: str = CACHE_BACKEND) -> CacheBackend:
+    if backend == "redis":
+        import redis.asyncio as redis
+        return RedisCache(redis.from_url(REDIS_URL))
+    return MemoryCache()
+
+
+cache = build_cache()
+
+
+async def product_key(product_id: int) -> str:
+    # Under a namespace token: renaming or deleting a category changes every
+    # product in it, and bumping the token drops them in one write.
+    token = await cache.namespace("product")
+    return f"product:{token}:{product_id}"
+
+
+def category_key(category_id: int) -> str:
+    return f"category:{category_id}"
+
+
+async def query_key(namespace: str, **params) -> str:
+    token = await cache.namespace(namespace)
+    raw = json.dumps(params, sort_keys=True, default=str)
+    return f"{namespace}:{token}:{hashlib.sha1(raw.encode()).hexdigest()}"
+
+
+async def invalidate_products(product_ids: Iterable[int] = ()):
+    await cache.delete([await product_key(i) for i in product_ids])
+    await cache.invalidate_namespace("products")
+
+
+async def invalidate_categories(category_ids: Iterable[int] = (), products: bool = False):
+    """``products`` when the products embedding the categories changed too,
+    i.e. a category was renamed or deleted."""
+    await cache.delete(category_key(i) for i in category_ids)
+    await cache.invalidate_namespace("categories")
+    if products:
+        await cache.invalidate_namespace("product")
+        await cache.invalidate_namespace("products")
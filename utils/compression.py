@@ -0,0 +1,179 @@
+import os
+import zlib
+from typing import Optional
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Smaller bodies are sent as they are; compressing them costs more than the
+# bytes it saves.
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+# Encodings offered, in order of preference when the client accepts several.
+COMPRESSION_ENCODINGS = os.getenv("COMPRESSION_ENCODINGS", "zstd,br,gzip")
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))
+COMPRESSION_ZSTD_LEVEL = int(os.getenv("COMPRESSION_ZSTD_LEVEL", "3"))
+
+_COMPRESSIBLE = ("application/json", "application/javascript", "application/xml", "image/svg+xml", "text/")
+
+
+class _Gzip:
+    def __init__(self):
+        self._z = zlib.compressobj(COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._z.compress(data)
+
+    def finish(self) -> bytes:
+        return self._z.flush()
+
+
+class _Brotli:
+    def __init__(self):
+        self._c = brotli.Compressor(quality=COMPRESSION_BROTLI_QUALITY)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._c.process(data)
+
+    def finish(self) -> bytes:
+        return self._c.finish()
+
+
+class _Zstd:
+    def __init__(self):
+        # One compressor per response: a compressobj shares the context of
+        # its ZstdCompressor, so interleaved responses cannot share one.
+        self._c = zstandard.ZstdCompressor(level=COMPRESSION_ZSTD_LEVEL).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._c.compress(data)
+
+    def finish(self) -> bytes:
+        return self._c.flush()
+
+
+_COMPRESSORS = {"gzip": _Gzip}
+if brotli is not None:
+    _COMPRESSORS["br"] = _Brotli
+if zstandard is not None:
+    _COMPRESSORS["zstd"] = _Zstd
+
+
+def available_encodings(names: str = COMPRESSION_ENCODINGS) -> tuple:
+    """The configured encodings whose library is installed."""
+    return tuple(n for n in (v.strip() for v in names.split(",")) if n in _COMPRESSORS)
+
+
+def choose_encoding(accept_encoding: str, encodings: tuple) -> Optional[str]:
+    """The first of ``encodings`` with the highest q-value in an
+    Accept-Encoding header, or None."""
+    accepted = {}
+    for item in accept_encoding.lower().split(","):
+        coding, _, params = item.partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[coding.strip()] = q
+    best, best_q = None, 0.0
+    for name in encodings:
+        q = accepted.get(name, accepted.get("*", 0.0))
+        if q > best_q:
+            best, best_q = name, q
+    return best
+
+
+def _compressible(status: int, headers: Headers) -> bool:
+    if status < 200 or status in (204, 206, 304) or "content-encoding" in headers:
+        return False
+    return headers.get("content-type", "").startswith(_COMPRESSIBLE)
+
+
+class CompressionMiddleware:
+    """Pure ASGI middleware compressing response bodies with the best
+    encoding the client accepts.
+
+    The start of a response is held back until its first body chunk, so
+    that a single-chunk body under ``minimum_size`` is sent unchanged.
+    Streamed bodies are compressed chunk by chunk. Files sent with
+    ``http.response.pathsend`` and partial content are left alone.
+    """
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE, encodings: Optional[tuple] = None):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.encodings = available_encodings() if encodings is None else encodings
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""), self.encodings)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+        compressor = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start, compressor, passthrough
+            if message["type"] == "http.response.start":
+                if _compressible(message["status"], Headers(raw=message["headers"])):
+                    start = message
+                else:
+                    passthrough = True
+                    await send(message)
+                return
+            if passthrough or message["type"] != "http.response.body":
+                if start is not None:
+                    await send(start)
+                    start = None
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if start is not None:
+                message_start, start = start, None
+                if not more_body and len(body) < self.minimum_size:
+                    passthrough = True
+                    await send(message_start)
+                    await send(message)
+                    return
+                headers = MutableHeaders(scope=message_start)
+                headers["Content-Encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+                etag = headers.get("etag")
+                if etag and not etag.startswith("W/"):
+                    # The bytes differ from the identity representation.
+                    headers["ETag"] = "W/" + etag
+                compressor = _COMPRESSORS[encoding]()
+                if not more_body:
+                    body = compressor.compress(body) + compressor.finish()
+                    headers["Content-Length"] = str(len(body))
+                    await send(message_start)
+                    await send({"type": "http.response.body", "body": body})
+                    return
+                del headers["Content-Length"]
+                await send(message_start)
+
+            data = compressor.compress(body)
+            if not more_body:
+                data += compressor.finish()
+            if data or not more_body:
+                await send({"type": "http.response.body", "body": data, "more_body": more_body})
+
+        await self.app(scope, receive, send_wrapper)
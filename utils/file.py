@@ -1,28 +1,375 @@
+import asyncio
+import hashlib
+import logging
 import os
-import uuid
-from fastapi import UploadFile
+import tempfile
+import time
+from collections import Counter
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import delete, select, union, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+import models
+from database import AsyncSessionLocal
+from utils.metrics import UPLOAD_BYTES, UPLOAD_SECONDS
 
-def save_uploaded_file(upload_file: UploadFile, upload_dir: str = "uploads") -> str:
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+UPLOAD_MAX_SIZE = int(os.getenv("UPLOAD_MAX_SIZE", str(20 * 1024 * 1024)))
+# Whole request bodies, every file and field together. Unlike
+# UPLOAD_MAX_SIZE it is enforced while the body arrives, before Starlette
+# spools it to disk; 0 disables it.
+UPLOAD_MAX_REQUEST_SIZE = int(os.getenv("UPLOAD_MAX_REQUEST_SIZE", str(5 * UPLOAD_MAX_SIZE)))
+GC_BATCH_SIZE = int(os.getenv("UPLOAD_GC_BATCH_SIZE", "500"))
+# Seconds between collections in the app; 0 leaves them to gc_uploads.py.
+GC_INTERVAL = float(os.getenv("UPLOAD_GC_INTERVAL", "60"))
+# Seconds between sweeps for files no row references; 0 disables them.
+SWEEP_INTERVAL = float(os.getenv("UPLOAD_SWEEP_INTERVAL", "3600"))
+# Files younger than this are never swept: they may belong to an upload
+# whose transaction has not committed yet.
+SWEEP_GRACE = float(os.getenv("UPLOAD_SWEEP_GRACE", "3600"))
+UPLOAD_URL_PREFIX = os.getenv("UPLOAD_URL_PREFIX", "/" + UPLOAD_DIR.strip("/"))
+
+_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+class StoredFile(NamedTuple):
+    path: str
+    sha256: str
+    size: int
+    content_type: Optional[str] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+
+
+class _Spooled(NamedTuple):
+    tmp_path: str
+    stored: StoredFile
+
+
+def blob_path(sha256: str, ext: str, upload_dir: str = UPLOAD_DIR) -> str:
+    return os.path.join(upload_dir, sha256[:2], sha256[2:4], f"{sha256}{ext.lower()}")
+
+
+def public_url(path: str, upload_dir: str = UPLOAD_DIR) -> str:
+    relative = os.path.relpath(path, upload_dir).replace(os.sep, "/")
+    return f"{UPLOAD_URL_PREFIX.rstrip('/')}/{relative}"
+
+
+def _dimensions(path: str) -> Tuple[Optional[int], Optional[int]]:
+    if Image is None:
+        return None, None
+    try:
+        with Image.open(path) as image:
+            return image.size
+    except Exception:
+        return None, None
+
+
+def _write_temp(source, upload_dir: str, ext: str, content_type: Optional[str], max_size: int) -> _Spooled:
     os.makedirs(upload_dir, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+
+    fd, tmp_path = tempfile.mkstemp(dir=upload_dir, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while chunk := source.read(UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if size > max_size:
+                    raise HTTPException(status_code=413, detail=f"File exceeds the {max_size} bytes limit")
+                digest.update(chunk)
+                out.write(chunk)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+    sha256 = digest.hexdigest()
+    width, height = _dimensions(tmp_path)
+    return _Spooled(tmp_path, StoredFile(blob_path(sha256, ext, upload_dir), sha256, size, content_type, width, height))
+
+
+class _BodyTooLarge(HTTPException):
+    def __init__(self, max_size: int):
+        super().__init__(status_code=413, detail=f"Request body exceeds the {max_size} bytes limit")
+
+
+class BodySizeLimitMiddleware:
+    """Pure ASGI middleware refusing request bodies over ``max_size`` bytes
+    with 413: before reading anything when Content-Length is over, else
+    as soon as that many bytes arrived (chunked requests, lying clients).
+
+    The error is raised from ``receive``; it is an HTTPException so that
+    FastAPI passes it through its form parsing instead of answering 400.
+    """
+
+    def __init__(self, app, max_size: int = UPLOAD_MAX_REQUEST_SIZE):
+        self.app = app
+        self.max_size = max_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.max_size:
+            await self.app(scope, receive, send)
+            return
+        length = Headers(scope=scope).get("content-length", "")
+        if length.isdigit() and int(length) > self.max_size:
+            await self._reject(scope, receive, send)
+            return
+
+        received = 0
+        started = False
+
+        async def receive_wrapper():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_size:
+                    raise _BodyTooLarge(self.max_size)
+            return message
+
+        async def send_wrapper(message):
+            nonlocal started
+            if message["type"] == "http.response.start":
+                started = True
+            await send(message)
+
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        except _BodyTooLarge:
+            if started:
+                raise
+            await self._reject(scope, receive, send)
+
+    async def _reject(self, scope, receive, send):
+        error = _BodyTooLarge(self.max_size)
+        response = ORJSONResponse({"detail": error.detail}, status_code=error.status_code, headers={"Connection": "close"})
+        await response(scope, receive, send)
 
-    ext = os.path.splitext(upload_file.filename)[1]
-    
-    unique_name = f"{uuid.uuid4().hex}{ext}"
-    file_path = os.path.join(upload_dir, unique_name)
 
-    with open(file_path, "wb") as f:
-        f.write(upload_file.file.read())
+def _place(spooled: List[_Spooled]):
+    for tmp_path, stored in spooled:
+        if os.path.exists(stored.path):
+            os.remove(tmp_path)
+            # A fresh mtime keeps the sweeper off the file until the blob
+            # row of this upload is committed.
+            os.utime(stored.path)
+            continue
+        os.makedirs(os.path.dirname(stored.path), exist_ok=True)
+        os.replace(tmp_path, stored.path)
 
-    return file_path
 
-def delete_uploaded_file(file: str = None, multiple_file: list[str] = None):
-    if file and os.path.exists(file):
-        os.remove(file)
+def _remove_files(paths: Iterable[str]):
+    for path in paths:
+        try:
+            os.remove(os.path.normpath(path))
+        except FileNotFoundError:
+            pass
 
-    if multiple_file:
-        for f in multiple_file:
-            path = os.path.normpath(f)
-            if os.path.exists(path):
+
+async def _spool(upload_file: UploadFile, upload_dir: str, max_size: int) -> _Spooled:
+    ext = os.path.splitext(upload_file.filename or "")[1]
+    await upload_file.seek(0)
+    start = time.perf_counter()
+    spooled = await run_in_threadpool(_write_temp, upload_file.file, upload_dir, ext, upload_file.content_type, max_size)
+    UPLOAD_SECONDS.observe(time.perf_counter() - start)
+    UPLOAD_BYTES.inc(spooled.stored.size)
+    return spooled
+
+
+async def retain_files(db: AsyncSession, files: List[StoredFile]):
+    if not files:
+        return
+    counts = Counter(f.path for f in files)
+    by_path = {f.path: f for f in files}
+    rows = [
+        {"path": path, "sha256": by_path[path].sha256, "size": by_path[path].size, "refcount": counts[path]}
+        for path in sorted(counts)
+    ]
+    stmt = _INSERTS[db.bind.dialect.name](models.Blobs).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[models.Blobs.path],
+        set_={"refcount": models.Blobs.refcount + stmt.excluded.refcount},
+    )
+    await db.execute(stmt)
+
+
+async def release_files(db: AsyncSession, paths: Iterable[str]):
+    by_count = {}
+    for path, count in Counter(p for p in paths if p).items():
+        by_count.setdefault(count, []).append(path)
+    for count, group in by_count.items():
+        await db.execute(
+            update(models.Blobs)
+            .where(models.Blobs.path.in_(group))
+            .values(refcount=models.Blobs.refcount - count)
+        )
+
+
+async def store_uploaded_files(upload_files: List[UploadFile], db: AsyncSession, upload_dir: str = UPLOAD_DIR, max_size: int = UPLOAD_MAX_SIZE) -> List[StoredFile]:
+    results = await asyncio.gather(
+        *(_spool(f, upload_dir, max_size) for f in upload_files),
+        return_exceptions=True,
+    )
+    spooled = [r for r in results if isinstance(r, _Spooled)]
+    try:
+        errors = [r for r in results if isinstance(r, BaseException)]
+        if errors:
+            raise errors[0]
+        # The blob rows are locked by the upsert until commit, so the
+        # collector cannot remove a file we are about to reference.
+        await retain_files(db, [s.stored for s in spooled])
+        await run_in_threadpool(_place, spooled)
+    except BaseException:
+        await run_in_threadpool(_remove_files, [s.tmp_path for s in spooled])
+        raise
+    return [s.stored for s in spooled]
+
+
+async def save_uploaded_files(upload_files: List[UploadFile], db: AsyncSession, upload_dir: str = UPLOAD_DIR) -> List[str]:
+    return [f.path for f in await store_uploaded_files(upload_files, db, upload_dir)]
+
+
+async def save_uploaded_file(upload_file: UploadFile, db: AsyncSession, upload_dir: str = UPLOAD_DIR) -> str:
+    paths = await save_uploaded_files([upload_file], db, upload_dir)
+    return paths[0]
+
+
+async def _delete_variants(db: AsyncSession, source_paths: List[str]) -> List[str]:
+    if not source_paths:
+        return []
+    return (await db.scalars(
+        delete(models.Image_Variants)
+        .where(models.Image_Variants.source_path.in_(source_paths))
+        .returning(models.Image_Variants.path)
+    )).all()
+
+
+async def remove_variants(db: AsyncSession, source_paths: List[str]):
+    paths = await _delete_variants(db, source_paths)
+    await run_in_threadpool(_remove_files, paths)
+
+
+async def collect_garbage(db: AsyncSession, batch_size: int = GC_BATCH_SIZE) -> int:
+    collected = 0
+    while True:
+        stmt = select(models.Blobs.path).where(models.Blobs.refcount <= 0).limit(batch_size)
+        if db.bind.dialect.name == "postgresql":
+            stmt = stmt.with_for_update(skip_locked=True)
+        paths = (await db.scalars(stmt)).all()
+        if not paths:
+            break
+
+        started = time.time()
+        # SQLite takes no row locks: an upload may have retained one of them
+        # since the select, so only rows still unreferenced go.
+        deleted = (await db.scalars(
+            delete(models.Blobs)
+            .where(models.Blobs.path.in_(paths), models.Blobs.refcount <= 0)
+            .returning(models.Blobs.path)
+        )).all()
+        variants = await _delete_variants(db, deleted)
+        await db.commit()
+        # An upload that waited for this transaction re-creates the row and
+        # reuses the file, refreshing its mtime; such files are kept.
+        await run_in_threadpool(_remove_untouched, [*deleted, *variants], started)
+        collected += len(deleted)
+        if len(paths) < batch_size:
+            break
+    return collected
+
+
+def _unreferenced(upload_dir: str, referenced: set, grace: float, limit: int) -> List[str]:
+    cutoff = time.time() - grace
+    found, matched = [], 0
+    for root, _, names in os.walk(upload_dir):
+        for name in names:
+            path = os.path.join(root, name)
+            if os.path.abspath(path) in referenced:
+                matched += 1
+                continue
+            try:
+                if os.stat(path).st_mtime < cutoff:
+                    found.append(path)
+            except FileNotFoundError:
+                continue
+    if found and not matched:
+        # Rows point somewhere else (another UPLOAD_DIR or working directory),
+        # or there are none: a new or wrong database, or a restore in
+        # progress. Either way every file would look orphaned.
+        logger.warning("No referenced file found under %s (%d paths referenced), not sweeping it", upload_dir, len(referenced))
+        return []
+    return found[:limit]
+
+
+def _remove_untouched(paths: Iterable[str], since: float) -> int:
+    """Remove the files not modified since ``since`` (a time.time())."""
+    removed = 0
+    for path in paths:
+        try:
+            if os.stat(path).st_mtime < since:
                 os.remove(path)
+                removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
+
+
+def _remove_if_old(paths: Iterable[str], grace: float) -> int:
+    return _remove_untouched(paths, time.time() - grace)
+
+
+async def sweep_orphans(db: AsyncSession, upload_dir: str = UPLOAD_DIR, grace: float = SWEEP_GRACE, batch_size: int = GC_BATCH_SIZE) -> int:
+    """Remove files under ``upload_dir`` that no row references and that are
+    older than ``grace`` seconds: leftovers of crashes and failed requests,
+    or files copied in by hand. Stops after ``batch_size`` files."""
+    referenced = set()
+    stmt = union(
+        select(models.Blobs.path),
+        select(models.Image_Variants.path),
+        select(models.Products.image_main),
+        select(models.Product_Images.path),
+        select(models.Categories.image),
+    )
+    async for path in await db.stream_scalars(stmt):
+        if path:
+            referenced.add(os.path.abspath(path))
+    await db.rollback()
+
+    orphans = await run_in_threadpool(_unreferenced, upload_dir, referenced, grace, batch_size)
+    # Checked again right before removal: an upload may have reused one of
+    # them (and refreshed its mtime) since the references were read.
+    return await run_in_threadpool(_remove_if_old, orphans, grace)
+
 
-    return ""
\ No newline at end of file
+async def run_collector(interval: float = GC_INTERVAL, sweep_interval: float = SWEEP_INTERVAL):
+    """Background loop of the app: removes released files in batches after
+    the transactions that released them committed, and sweeps orphans."""
+    next_sweep = time.monotonic() + (sweep_interval if sweep_interval > 0 else float("inf"))
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            async with AsyncSessionLocal() as db:
+                collected = await collect_garbage(db)
+                if collected:
+                    logger.info("Removed %d unreferenced files", collected)
+                if time.monotonic() >= next_sweep:
+                    next_sweep = time.monotonic() + sweep_interval
+                    swept = await sweep_orphans(db)
+                    if swept:
+                        logger.info("Swept %d orphaned files", swept)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Upload garbage collection failed")
@@ -0,0 +1,244 @@
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Iterable, List, Optional, Tuple
+from sqlalchemy import select, union
+from sqlalchemy.dialects import postgresql, sqlite
+import models
+from database import AsyncSessionLocal
+from utils.cache import invalidate_categories, invalidate_products
+from utils.file import UPLOAD_DIR, StoredFile, remove_variants
+
+try:
+    from PIL import Image, ImageOps, UnidentifiedImageError, features
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+IMAGE_VARIANT_SIZES = os.getenv("IMAGE_VARIANT_SIZES", "thumb:200,medium:800")
+IMAGE_VARIANT_FORMATS = os.getenv("IMAGE_VARIANT_FORMATS", "webp,avif")
+IMAGE_VARIANT_QUALITY = int(os.getenv("IMAGE_VARIANT_QUALITY", "80"))
+IMAGE_POOL_SIZE = int(os.getenv("IMAGE_POOL_SIZE", "2"))
+
+_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+def _parse_sizes(value: str) -> List[Tuple[str, int]]:
+    sizes = []
+    for item in filter(None, (v.strip() for v in value.split(","))):
+        name, _, edge = item.partition(":")
+        sizes.append((name, int(edge)))
+    return sizes
+
+
+def _supported_formats(value: str) -> List[str]:
+    formats = []
+    for fmt in filter(None, (v.strip().lower() for v in value.split(","))):
+        if Image is not None and fmt in ("webp", "avif") and not features.check(fmt):
+            logger.warning("Pillow was built without %s support, skipping those variants", fmt)
+            continue
+        formats.append(fmt)
+    return formats
+
+
+SIZES = _parse_sizes(IMAGE_VARIANT_SIZES)
+FORMATS = _supported_formats(IMAGE_VARIANT_FORMATS)
+
+
+def variant_path(sha256: str, name: str, edge: int, quality: int, fmt: str, upload_dir: str = UPLOAD_DIR) -> str:
+    # The settings are part of the name: a file rendered under other ones is
+    # never mistaken for the current variant, and its URL stays immutable.
+    return os.path.join(upload_dir, "variants", sha256[:2], sha256[2:4], f"{sha256}-{name}_{edge}q{quality}.{fmt}")
+
+
+def render_variants(source_path: str, sha256: str, sizes, formats, quality: int, upload_dir: str) -> List[dict]:
+    """Write every size/format of one image and describe the files.
+
+    Runs in a worker process. Variant names are derived from the source
+    hash and the settings, so files that already exist are reused instead
+    of re-encoded.
+    """
+    try:
+        with Image.open(source_path) as source:
+            source = ImageOps.exif_transpose(source)
+            if source.mode not in ("RGB", "RGBA"):
+                source = source.convert("RGBA" if "transparency" in source.info or "A" in source.mode else "RGB")
+            results = []
+            for name, edge in sizes:
+                image = source.copy()
+                image.thumbnail((edge, edge))
+                for fmt in formats:
+                    path = variant_path(sha256, name, edge, quality, fmt, upload_dir)
+                    if not os.path.exists(path):
+                        os.makedirs(os.path.dirname(path), exist_ok=True)
+                        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+                        try:
+                            with os.fdopen(fd, "wb") as out:
+                                frame = image if fmt != "jpeg" else image.convert("RGB")
+                                frame.save(out, format=fmt.upper(), quality=quality)
+                            os.replace(tmp_path, path)
+                        except BaseException:
+                            os.remove(tmp_path)
+                            raise
+                    results.append({
+                        "name": name,
+                        "format": fmt,
+                        "path": path,
+                        "width": image.width,
+                        "height": image.height,
+                        "size": os.path.getsize(path),
+                    })
+            return results
+    except (FileNotFoundError, UnidentifiedImageError):
+        return []
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        # Forked workers would inherit the server's signal handlers and
+        # threads; spawned ones start clean and exit with it.
+        _executor = ProcessPoolExecutor(max_workers=IMAGE_POOL_SIZE, mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+
+def _discard_executor(executor: ProcessPoolExecutor):
+    """Drop a pool whose worker died, e.g. killed for memory; it refuses
+    all further work, so the next call starts a new one."""
+    global _executor
+    if _executor is executor:
+        _executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def _render(executor: ProcessPoolExecutor, path: str, sha256: str, upload_dir: str) -> List[dict]:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, render_variants, path, sha256, SIZES, FORMATS, IMAGE_VARIANT_QUALITY, upload_dir)
+
+
+async def _render_all(sources: dict, upload_dir: str) -> dict:
+    """Render every source; returns each path's variants or exception.
+
+    Sources lost to a broken pool are retried once on a new pool. A file
+    that kills its worker again is given up on.
+    """
+    results = {}
+    pending = sources
+    for _ in range(2):
+        executor = _get_executor()
+        rendered = await asyncio.gather(
+            *(_render(executor, path, sha256, upload_dir) for path, sha256 in pending.items()),
+            return_exceptions=True,
+        )
+        results.update(zip(pending, rendered))
+        broken = [path for path, result in zip(pending, rendered) if isinstance(result, BrokenProcessPool)]
+        if not broken:
+            break
+        logger.warning("image worker pool broke while rendering %s, starting a new one", broken)
+        _discard_executor(executor)
+        pending = {path: sources[path] for path in broken}
+    return results
+
+
+def _is_image(stored: StoredFile) -> bool:
+    return stored.content_type is None or stored.content_type.startswith("image/")
+
+
+async def _owners(db, paths: List[str]) -> Tuple[List[int], List[int]]:
+    product_ids = (await db.scalars(union(
+        select(models.Products.id).where(models.Products.image_main.in_(paths)),
+        select(models.Product_Images.product_id).where(models.Product_Images.path.in_(paths)),
+    ))).all()
+    category_ids = (await db.scalars(
+        select(models.Categories.id).where(models.Categories.image.in_(paths))
+    )).all()
+    return product_ids, category_ids
+
+
+async def generate_variants(files: Iterable[StoredFile], upload_dir: str = UPLOAD_DIR):
+    """Render the configured variants of freshly stored files and record them.
+
+    Meant to run as a background task once the upload is committed; a
+    failure is logged and leaves the original image usable.
+    """
+    if Image is None or not SIZES or not FORMATS:
+        return
+    # Files registered before uploads were hashed have no sha256; their path
+    # is just as unique for naming the variants.
+    sources = {
+        f.path: f.sha256 or hashlib.sha256(f.path.encode()).hexdigest()
+        for f in files if _is_image(f)
+    }
+    if not sources:
+        return
+
+    rows = []
+    for path, result in (await _render_all(sources, upload_dir)).items():
+        if isinstance(result, BaseException):
+            logger.warning("could not render variants of %s", path, exc_info=result)
+            continue
+        rows.extend({"source_path": path, **variant} for variant in result)
+    if not rows:
+        return
+
+    async with AsyncSessionLocal() as db:
+        # Lock the blob rows so the collector cannot remove a source while its
+        # variants are recorded; sources released in the meantime are dropped.
+        stmt = select(models.Blobs.path, models.Blobs.refcount).where(models.Blobs.path.in_(sources))
+        if db.bind.dialect.name == "postgresql":
+            stmt = stmt.with_for_update()
+        live = {path for path, refcount in (await db.execute(stmt)).all() if refcount > 0}
+        dead = [path for path in sources if path not in live]
+        rows = [row for row in rows if row["source_path"] in live]
+
+        await remove_variants(db, dead)
+        product_ids, category_ids = [], []
+        if rows:
+            insert = _INSERTS[db.bind.dialect.name](models.Image_Variants).values(rows)
+            # A variant rendered under other settings is replaced; its file
+            # is left to the orphan sweep.
+            await db.execute(insert.on_conflict_do_update(
+                index_elements=["source_path", "name", "format"],
+                set_={c: insert.excluded[c] for c in ("path", "width", "height", "size")},
+            ))
+            # The owners' representations now list the variants. Their
+            # versions stay: a client holding the ETag of the create or
+            # update it just made would otherwise fail its next If-Match.
+            product_ids, category_ids = await _owners(db, sorted(live))
+        await db.commit()
+
+    if product_ids:
+        await invalidate_products(product_ids)
+    if category_ids:
+        await invalidate_categories(category_ids)
+
+
+async def purge_variants(source_paths: Iterable[str]):
+    """Remove the variants of files that nothing references anymore."""
+    source_paths = sorted({p for p in source_paths if p})
+    if not source_paths:
+        return
+    async with AsyncSessionLocal() as db:
+        stmt = select(models.Blobs.path).where(
+            models.Blobs.path.in_(source_paths),
+            models.Blobs.refcount <= 0,
+        )
+        if db.bind.dialect.name == "postgresql":
+            stmt = stmt.with_for_update(skip_locked=True)
+        await remove_variants(db, (await db.scalars(stmt)).all())
+        await db.commit()
+
+
+def shutdown_executor(wait: bool = False):
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=wait, cancel_futures=True)
+        _executor = None
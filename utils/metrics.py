@@ -0,0 +1,293 @@
+import os
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Optional
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+from prometheus_client.core import CounterMetricFamily, HistogramMetricFamily
+from sqlalchemy import event
+from starlette.requests import Request
+from starlette.responses import Response
+from utils.cache import cache
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+# Set by serve.py when it runs several workers: every process writes its
+# values to files there and /metrics adds them up.
+MULTIPROCESS = "PROMETHEUS_MULTIPROC_DIR" in os.environ
+
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+_QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+DB_POOL_CHECKED_OUT = Gauge("db_pool_checked_out", "Connections currently checked out.", ["engine"], multiprocess_mode="livesum")
+DB_POOL_SIZE = Gauge("db_pool_size", "Connections held by the pool.", ["engine"], multiprocess_mode="livesum")
+DB_POOL_OVERFLOW = Gauge("db_pool_overflow", "Connections opened beyond the pool size.", ["engine"], multiprocess_mode="livesum")
+DB_QUERY_SECONDS = Histogram("db_query_duration_seconds", "Database query execution time.", buckets=_QUERY_BUCKETS)
+DB_POOL_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection.",
+    buckets=_QUERY_BUCKETS + (2.5, 5.0, 10.0, 30.0),
+)
+
+BCRYPT_SECONDS = Histogram(
+    "bcrypt_duration_seconds", "Password hashing time, including the wait for a worker.",
+    ["operation"], buckets=(0.05, 0.1, 0.2, 0.3, 0.5, 1.0, 2.0, 5.0),
+)
+BCRYPT_REJECTED = Counter("bcrypt_rejected_total", "Hashing requests refused because the pool was full.")
+
+UPLOAD_BYTES = Counter("upload_bytes_total", "Bytes received in uploaded files.")
+UPLOAD_SECONDS = Histogram(
+    "upload_duration_seconds", "Time to stream and hash one uploaded file.",
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+
+# [queries, seconds] of the request being handled; a list so that the
+# greenlets SQLAlchemy runs the driver in can update it in place.
+_db_stats: ContextVar[Optional[list]] = ContextVar("db_stats", default=None)
+
+# Counters of ``cache.stats()``: (stat, metric name, help).
+_CACHE_STATS = (
+    ("hits", "cache_hits", "Cache lookups that found an entry."),
+    ("misses", "cache_misses", "Cache lookups that found no entry."),
+    ("evictions", "cache_evictions", "Entries the memory cache dropped to stay under CACHE_MAX_ENTRIES."),
+)
+
+
+def _route_template(scope) -> str:
+    route = scope.get("route")
+    if route is not None:
+        return route.path
+    if "endpoint" in scope:
+        # Mounted apps, such as the uploads.
+        return scope.get("root_path") or "/"
+    return "unmatched"
+
+
+class _RouteStats:
+    __slots__ = ("buckets", "count", "sum", "db_queries", "db_seconds")
+
+    def __init__(self):
+        self.buckets = [0] * len(_LATENCY_BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.db_queries = 0
+        self.db_seconds = 0.0
+
+
+class _HTTPCollector:
+    """Request metrics kept in plain dicts by the middleware and turned into
+    metric families only when /metrics is scraped.
+
+    prometheus_client takes a lock on every increment; per-request series are
+    only ever updated from the event loop thread, so they skip that."""
+
+    def __init__(self):
+        self.routes = {}
+
+    def observe(self, key, elapsed: float, db_queries: int, db_seconds: float):
+        stats = self.routes.get(key)
+        if stats is None:
+            stats = self.routes[key] = _RouteStats()
+        index = bisect_left(_LATENCY_BUCKETS, elapsed)
+        if index < len(_LATENCY_BUCKETS):
+            stats.buckets[index] += 1
+        stats.count += 1
+        stats.sum += elapsed
+        stats.db_queries += db_queries
+        stats.db_seconds += db_seconds
+
+    def collect(self):
+        latency = HistogramMetricFamily(
+            "http_request_duration_seconds",
+            "Time until the last body chunk was sent, by route template and status.",
+            labels=["method", "route", "status"],
+        )
+        queries = CounterMetricFamily(
+            "http_request_db_queries", "Database queries run by requests.",
+            labels=["method", "route", "status"],
+        )
+        seconds = CounterMetricFamily(
+            "http_request_db_seconds", "Time requests spent waiting on database queries.",
+            labels=["method", "route", "status"],
+        )
+        for (method, route, status), stats in list(self.routes.items()):
+            labels = [method, route, str(status)]
+            buckets, total = [], 0
+            for bound, count in zip(_LATENCY_BUCKETS, stats.buckets):
+                total += count
+                buckets.append((str(bound), total))
+            buckets.append(("+Inf", stats.count))
+            latency.add_metric(labels, buckets, stats.sum)
+            queries.add_metric(labels, stats.db_queries)
+            seconds.add_metric(labels, stats.db_seconds)
+        yield latency
+        yield queries
+        yield seconds
+        stats = cache.stats()
+        for stat, name, documentation in _CACHE_STATS:
+            yield CounterMetricFamily(name, documentation, value=stats[stat])
+
+
+class _SharedHTTPStats:
+    """The same series as ``_HTTPCollector`` kept in prometheus_client
+    metrics, whose values live in the multiprocess files."""
+
+    def __init__(self):
+        labels = ["method", "route", "status"]
+        self.latency = Histogram(
+            "http_request_duration_seconds",
+            "Time until the last body chunk was sent, by route template and status.",
+            labels, buckets=_LATENCY_BUCKETS,
+        )
+        self.queries = Counter("http_request_db_queries", "Database queries run by requests.", labels)
+        self.seconds = Counter("http_request_db_seconds", "Time requests spent waiting on database queries.", labels)
+        self.cache = [(stat, Counter(name, documentation)) for stat, name, documentation in _CACHE_STATS]
+        self.cache_seen = {stat: 0 for stat, _, _ in _CACHE_STATS}
+
+    def observe(self, key, elapsed: float, db_queries: int, db_seconds: float):
+        method, route, status = key
+        labels = (method, route, str(status))
+        self.latency.labels(*labels).observe(elapsed)
+        if db_queries:
+            self.queries.labels(*labels).inc(db_queries)
+            self.seconds.labels(*labels).inc(db_seconds)
+        # The cache counts in plain ints; the new counts since the last
+        # request go to the files once the request is done.
+        stats = cache.stats()
+        for stat, counter in self.cache:
+            delta = stats[stat] - self.cache_seen[stat]
+            if delta:
+                counter.inc(delta)
+                self.cache_seen[stat] = stats[stat]
+
+
+if MULTIPROCESS:
+    _http = _SharedHTTPStats()
+else:
+    _http = _HTTPCollector()
+    REGISTRY.register(_http)
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware recording latency and database use per route."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        stats = [0, 0.0]
+        token = _db_stats.set(stats)
+        status = 500
+        recorded = False
+
+        def record():
+            nonlocal recorded
+            recorded = True
+            key = (scope["method"], _route_template(scope), status)
+            _http.observe(key, time.perf_counter() - start, stats[0], stats[1])
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+            # Background tasks run after the body is sent; they are not
+            # part of the latency the client sees.
+            if not recorded and (
+                (message["type"] == "http.response.body" and not message.get("more_body", False))
+                or message["type"] == "http.response.pathsend"
+            ):
+                record()
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _db_stats.reset(token)
+            if not recorded:
+                record()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    DB_QUERY_SECONDS.observe(elapsed)
+    stats = _db_stats.get()
+    if stats is not None:
+        stats[0] += 1
+        stats[1] += elapsed
+
+
+def _handle_error(context):
+    starts = context.connection.info.get("query_start") if context.connection is not None else None
+    if starts:
+        starts.pop()
+
+
+def instrument_engine(engine, name: str):
+    """Time the queries of ``engine`` and export its pool usage.
+
+    Pool gauges are read when /metrics is scraped, not on every checkout,
+    unless several workers share the metrics.
+    """
+    sync_engine = getattr(engine, "sync_engine", engine)
+    event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(sync_engine, "handle_error", _handle_error)
+
+    pool = sync_engine.pool
+    if MULTIPROCESS:
+        # Other processes cannot call back into this one at scrape time, so
+        # the gauges are written on every checkout and checkin instead. The
+        # checkin event fires before the connection is back in the pool, so
+        # checkedout() would still count it there.
+        checked_out = DB_POOL_CHECKED_OUT.labels(name)
+        if hasattr(pool, "size"):
+            DB_POOL_SIZE.labels(name).set(pool.size())
+
+        def checkout(*args):
+            checked_out.inc()
+            if hasattr(pool, "overflow"):
+                DB_POOL_OVERFLOW.labels(name).set(max(0, pool.overflow()))
+
+        event.listen(sync_engine, "checkout", checkout)
+        event.listen(sync_engine, "checkin", lambda *args: checked_out.dec())
+        return
+    for gauge, read in ((DB_POOL_CHECKED_OUT, "checkedout"), (DB_POOL_SIZE, "size"), (DB_POOL_OVERFLOW, "overflow")):
+        if hasattr(pool, read):
+            # QueuePool.overflow() counts up from -pool_size until the pool is full.
+            gauge.labels(name).set_function(lambda read=getattr(pool, read): max(0, read()))
+
+
+class TimedPoolMixin:
+    """Adds checkout wait time to a SQLAlchemy ``QueuePool`` subclass."""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            DB_POOL_WAIT.observe(time.perf_counter() - start)
+
+
+async def metrics(request: Request) -> Response:
+    # A coroutine, so that Starlette runs it on the event loop: a sync
+    # handler would run in the threadpool and read _HTTPCollector's series
+    # while the middleware updates them.
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+def mark_process_dead():
+    """Drop this worker's live gauges from the multiprocess files when it
+    exits, e.g. when recycled after its maximum number of requests."""
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(os.getpid())
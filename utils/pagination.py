@@ -0,0 +1,27 @@
+import base64
+import binascii
+import json
+from fastapi import HTTPException
+
+
+def encode_cursor(values: dict) -> str:
+    raw = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> dict:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (binascii.Error, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(values, dict):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+
+def cursor_id(cursor: str) -> int:
+    value = decode_cursor(cursor).get("id")
+    if not isinstance(value, int):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return value
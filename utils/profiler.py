@@ -0,0 +1,157 @@
+import logging
+import os
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, List, Optional, Tuple
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+SQL_PROFILE = os.getenv("SQL_PROFILE", "false").lower() in ("1", "true", "yes")
+# A statement run this many times in one request is reported as a likely N+1.
+SQL_PROFILE_REPEAT_THRESHOLD = int(os.getenv("SQL_PROFILE_REPEAT_THRESHOLD", "3"))
+
+
+class QueryProfile:
+    def __init__(self, repeat_threshold: int = SQL_PROFILE_REPEAT_THRESHOLD):
+        self.repeat_threshold = repeat_threshold
+        self.queries: List[Tuple[str, float]] = []
+
+    def add(self, statement: str, elapsed: float):
+        self.queries.append((statement, elapsed))
+
+    @property
+    def count(self) -> int:
+        return len(self.queries)
+
+    @property
+    def seconds(self) -> float:
+        return sum(elapsed for _, elapsed in self.queries)
+
+    def repeated(self) -> List[Tuple[str, int]]:
+        """Statements whose SQL text, parameters aside, ran at least
+        ``repeat_threshold`` times, most repeated first."""
+        counts = Counter(statement for statement, _ in self.queries)
+        return [(s, n) for s, n in counts.most_common() if n >= self.repeat_threshold]
+
+    def summary(self) -> str:
+        return f"queries={self.count}; time_ms={self.seconds * 1000:.2f}; repeated={len(self.repeated())}"
+
+    def report(self) -> str:
+        lines = [self.summary()]
+        for statement, elapsed in self.queries:
+            lines.append(f"  {elapsed * 1000:8.2f} ms  {_short(statement)}")
+        for statement, count in self.repeated():
+            lines.append(f"  N+1? {count}x  {_short(statement)}")
+        return "\n".join(lines)
+
+
+def _short(statement: str, limit: int = 200) -> str:
+    statement = " ".join(statement.split())
+    return statement if len(statement) <= limit else statement[:limit] + "..."
+
+
+_profile: ContextVar[Optional[QueryProfile]] = ContextVar("sql_profile", default=None)
+# Profiles receiving every statement regardless of context, see capture_queries.
+_captures: List[QueryProfile] = []
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("profile_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["profile_start"].pop()
+    profile = _profile.get()
+    if profile is not None:
+        profile.add(statement, elapsed)
+    for capture in _captures:
+        if capture is not profile:
+            capture.add(statement, elapsed)
+
+
+def _handle_error(context):
+    starts = context.connection.info.get("profile_start") if context.connection is not None else None
+    if starts:
+        starts.pop()
+
+
+def instrument_engine(engine):
+    sync_engine = getattr(engine, "sync_engine", engine)
+    if not event.contains(sync_engine, "after_cursor_execute", _after_cursor_execute):
+        event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(sync_engine, "handle_error", _handle_error)
+
+
+class SQLProfilerMiddleware:
+    """Profiles the statements of every request.
+
+    The summary goes out in ``X-SQL-Profile`` and ``Server-Timing`` headers
+    and a log line; repeated statements are logged as warnings. Queries run
+    after the response has started (streaming, background tasks) are only
+    in the log line.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        profile = QueryProfile()
+        token = _profile.set(profile)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((b"x-sql-profile", profile.summary().encode()))
+                headers.append((
+                    b"server-timing",
+                    f'db;dur={profile.seconds * 1000:.2f};desc="{profile.count} queries"'.encode(),
+                ))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _profile.reset(token)
+            logger.info("%s %s: %s", scope["method"], scope["path"], profile.summary())
+            for statement, count in profile.repeated():
+                logger.warning("%s %s: possible N+1, %dx %s", scope["method"], scope["path"], count, _short(statement))
+
+
+@contextmanager
+def capture_queries(engine=None, repeat_threshold: int = SQL_PROFILE_REPEAT_THRESHOLD) -> Iterator[QueryProfile]:
+    """Record every statement run on ``engine`` while the block runs, from
+    any thread or task, e.g. behind a TestClient."""
+    if engine is None:
+        import database
+        engine = database.async_engine
+    instrument_engine(engine)
+    profile = QueryProfile(repeat_threshold)
+    _captures.append(profile)
+    try:
+        yield profile
+    finally:
+        _captures.remove(profile)
+
+
+def assert_max_queries(client, method: str, url: str, max_queries: int, **kwargs):
+    """Call an endpoint through ``client`` (a TestClient) and fail if it ran
+    more than ``max_queries`` statements. Returns the response.
+
+        assert_max_queries(client, "GET", "/products/?limit=50", 3)
+    """
+    with capture_queries() as profile:
+        response = client.request(method, url, **kwargs)
+    if profile.count > max_queries:
+        raise AssertionError(
+            f"{method} {url} ran {profile.count} queries, expected at most {max_queries}\n{profile.report()}"
+        )
+    return response
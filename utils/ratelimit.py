@@ -0,0 +1,217 @@
+import logging
+import math
+import os
+import time
+from collections import OrderedDict
+from typing import Callable, Iterable, NamedTuple, Optional, Tuple
+from fastapi import HTTPException, Request
+from fastapi.responses import ORJSONResponse
+from auth.tokens import InvalidToken, decode_token
+from utils.cache import REDIS_URL
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() in ("1", "true", "yes")
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+# Login and sign-up, which both run bcrypt, per client IP.
+RATE_LIMIT_AUTH = os.getenv("RATE_LIMIT_AUTH", "10/minute")
+# Product and category writes, per user (per IP without a valid token).
+RATE_LIMIT_WRITES = os.getenv("RATE_LIMIT_WRITES", "60/minute")
+
+_PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+
+class Rate(NamedTuple):
+    limit: int
+    period: float
+
+    @property
+    def per_second(self) -> float:
+        return self.limit / self.period
+
+
+def parse_rate(value: str) -> Optional[Rate]:
+    """``"10/minute"`` -> Rate(10, 60). An empty value or a limit of 0
+    means no limit."""
+    if not value:
+        return None
+    limit, _, period = value.partition("/")
+    limit = int(limit)
+    if limit <= 0:
+        return None
+    return Rate(limit, _PERIODS[period.strip().rstrip("s") or "second"])
+
+
+class RateLimiter:
+    """Token buckets: each key holds up to ``rate.limit`` tokens, refilled
+    continuously over ``rate.period``, and every request takes one."""
+
+    async def acquire(self, key: str, rate: Rate, cost: int = 1) -> float:
+        """Take ``cost`` tokens from the bucket of ``key``. Returns 0 when
+        they were taken, otherwise the seconds until there are enough."""
+        raise NotImplementedError
+
+
+class MemoryRateLimiter(RateLimiter):
+    """Buckets of this process only; with several workers every worker
+    allows the full rate."""
+
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._buckets: OrderedDict = OrderedDict()
+
+    async def acquire(self, key, rate, cost=1):
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            tokens = rate.limit
+        else:
+            tokens, updated = bucket
+            tokens = min(rate.limit, tokens + (now - updated) * rate.per_second)
+            self._buckets.move_to_end(key)
+        wait = 0.0
+        if tokens >= cost:
+            tokens -= cost
+        else:
+            wait = (cost - tokens) / rate.per_second
+        self._buckets[key] = (tokens, now)
+        while len(self._buckets) > self.max_keys:
+            # The least recently used bucket; it has refilled the longest.
+            self._buckets.popitem(last=False)
+        return wait
+
+
+# Runs atomically in the server, on the server's clock, so that all workers
+# share one bucket per key. Returns the wait as a string: Lua numbers become
+# integers on the way out.
+_TOKEN_BUCKET = """
+local limit = tonumber(ARGV[1])
+local per_second = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1])
+if tokens == nil then
+    tokens = limit
+else
+    tokens = math.min(limit, tokens + math.max(0, now - tonumber(bucket[2])) * per_second)
+end
+local wait = 0
+if tokens >= cost then
+    tokens = tokens - cost
+else
+    wait = (cost - tokens) / per_second
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(limit / per_second * 1000))
+return tostring(wait)
+"""
+
+
+class RedisRateLimiter(RateLimiter):
+    """Buckets shared by all workers, in any server speaking the Redis
+    protocol and running Lua scripts. Errors are logged and the request is
+    allowed, so the API keeps serving if Redis is down."""
+
+    def __init__(self, client, prefix: str = "ratelimit:"):
+        self.client = client
+        self.prefix = prefix
+        self._script = client.register_script(_TOKEN_BUCKET)
+
+    async def acquire(self, key, rate, cost=1):
+        try:
+            wait = await self._script(keys=[self.prefix + key], args=[rate.limit, rate.per_second, cost])
+        except Exception:
+            logger.warning("rate limit check failed for %s", key, exc_info=True)
+            return 0.0
+        return float(wait)
+
+
+def build_limiter(backend: str = RATE_LIMIT_BACKEND) -> RateLimiter:
+    if backend == "redis":
+        import redis.asyncio as redis
+        return RedisRateLimiter(redis.from_url(REDIS_URL))
+    return MemoryRateLimiter()
+
+
+limiter = build_limiter()
+
+
+def by_ip(scope) -> str:
+    client = scope.get("client")
+    return f"ip:{client[0] if client else 'unknown'}"
+
+
+def by_user(scope) -> str:
+    """The user id ``get_current_user`` would return for the request's
+    bearer token, or the client IP without a valid one."""
+    for name, value in scope["headers"]:
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            if scheme.lower() == "bearer" and token:
+                try:
+                    user_id = decode_token(token).get("id")
+                except InvalidToken:
+                    break
+                if user_id is not None:
+                    return f"user:{user_id}"
+            break
+    return by_ip(scope)
+
+
+class RateLimit:
+    """A rate for one group of routes, as a FastAPI dependency:
+
+        @router.post("/token", dependencies=[Depends(RateLimit("10/minute", "auth"))])
+
+    Dependencies run after FastAPI has parsed the request body; limits on
+    uploads belong in ``RateLimitMiddleware``, which answers before.
+    """
+
+    def __init__(self, rate: str, name: str, key: Callable = by_ip, limiter: Optional[RateLimiter] = None):
+        self.rate = parse_rate(rate)
+        self.name = name
+        self.key = key
+        self.limiter = limiter
+
+    async def check(self, scope) -> float:
+        """Seconds the request has to wait, 0 if it may go ahead."""
+        if self.rate is None or not RATE_LIMIT_ENABLED:
+            return 0.0
+        return await (self.limiter or limiter).acquire(f"{self.name}:{self.key(scope)}", self.rate)
+
+    async def __call__(self, request: Request):
+        wait = await self.check(request.scope)
+        if wait:
+            raise HTTPException(status_code=429, detail="Too many requests", headers=_retry_after(wait))
+
+
+def _retry_after(wait: float) -> dict:
+    return {"Retry-After": str(math.ceil(wait))}
+
+
+class RateLimitMiddleware:
+    """Pure ASGI middleware applying ``RateLimit``s by method and path
+    prefix, before the request body is read.
+
+    ``rules`` are ``(methods, path_prefix, limit)`` tuples; the first
+    matching rule applies.
+    """
+
+    def __init__(self, app, rules: Iterable[Tuple[Iterable[str], str, RateLimit]] = ()):
+        self.app = app
+        self.rules = [(frozenset(methods), prefix, limit) for methods, prefix, limit in rules]
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            for methods, prefix, limit in self.rules:
+                if scope["method"] in methods and scope["path"].startswith(prefix):
+                    wait = await limit.check(scope)
+                    if wait:
+                        response = ORJSONResponse({"detail": "Too many requests"}, status_code=429, headers=_retry_after(wait))
+                        await response(scope, receive, send)
+                        return
+                    break
+        await self.app(scope, receive, send)
@@ -0,0 +1,19 @@
+from typing import Any, Type
+from fastapi.responses import Response
+from pydantic import BaseModel
+
+
+class RawJSONResponse(Response):
+    """A body that is JSON already, from ``dump_json`` or the cache.
+
+    Returning it skips FastAPI's validation against the response_model, the
+    ``jsonable_encoder`` pass and the encoding of the result; the route's
+    response_model still documents the shape.
+    """
+    media_type = "application/json"
+
+
+def dump_json(schema: Type[BaseModel], obj: Any) -> str:
+    """Serialize ORM rows (or dicts of them) through ``schema`` in one pass
+    in pydantic-core, without building an intermediate dict."""
+    return schema.model_validate(obj, from_attributes=True).model_dump_json()
@@ -0,0 +1,36 @@
+import re
+from typing import Optional
+from sqlalchemy import Float, func, literal, literal_column, or_, tuple_
+from sqlalchemy.dialects.postgresql import TSVECTOR
+import models
+
+SEARCH_CONFIG = "simple"
+
+# Generated column created by the search migration; it is not mapped on the
+# model so that it is never loaded with the product row.
+search_vector = literal_column("products.search_vector", TSVECTOR)
+
+
+def prefix_tsquery(q: str) -> Optional[str]:
+    terms = re.findall(r"\w+", q.lower())
+    if not terms:
+        return None
+    return " & ".join(f"{term}:*" for term in terms)
+
+
+def search_clauses(q: str, tsquery: str):
+    query = func.to_tsquery(SEARCH_CONFIG, tsquery)
+    matches = or_(
+        search_vector.op("@@")(query),
+        literal(q).op("<%")(models.Products.name),
+    )
+    rank = func.greatest(
+        func.ts_rank_cd(search_vector, query),
+        func.word_similarity(q, models.Products.name),
+        type_=Float,
+    )
+    return matches, rank
+
+
+def after_cursor(rank, last_rank: float, last_id: int):
+    return tuple_(rank, models.Products.id) < tuple_(literal(last_rank, Float), literal(last_id))
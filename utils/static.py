@@ -0,0 +1,64 @@
+import os
+import re
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Scope
+from utils.file import UPLOAD_CHUNK_SIZE, UPLOAD_DIR
+
+UPLOAD_CACHE_MAX_AGE = int(os.getenv("UPLOAD_CACHE_MAX_AGE", str(365 * 24 * 3600)))
+# Internal location nginx serves UPLOAD_DIR from, e.g. "/_uploads/". When set,
+# responses carry X-Accel-Redirect and nginx sends the file itself.
+UPLOAD_ACCEL_REDIRECT = os.getenv("UPLOAD_ACCEL_REDIRECT", "")
+
+# uploads/aa/bb/<sha256>.<ext> and their variants, <sha256>-<name>.<fmt>
+_CONTENT_ADDRESSED = re.compile(r"^[0-9a-f]{64}(-\w+)?$")
+
+
+class _UploadResponse(FileResponse):
+    chunk_size = UPLOAD_CHUNK_SIZE
+
+
+class UploadFiles(StaticFiles):
+    """Serves the file store.
+
+    Content-addressed names never change content, so they get a strong ETag
+    taken from the name and an immutable Cache-Control. Other files are
+    revalidated on every use. Range requests and ``http.response.pathsend``
+    (for servers that implement it) are handled by ``FileResponse``.
+    """
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope: Scope, status_code: int = 200) -> Response:
+        name = os.path.basename(full_path)
+        if name.endswith(".tmp"):
+            raise HTTPException(status_code=404)
+
+        headers = {}
+        stem = os.path.splitext(name)[0]
+        if _CONTENT_ADDRESSED.match(stem):
+            headers["etag"] = f'"{name}"'
+            headers["cache-control"] = f"public, max-age={UPLOAD_CACHE_MAX_AGE}, immutable"
+        else:
+            headers["cache-control"] = "no-cache"
+
+        response = _UploadResponse(full_path, status_code=status_code, headers=headers, stat_result=stat_result)
+        if self.is_not_modified(response.headers, Headers(scope=scope)):
+            return NotModifiedResponse(response.headers)
+        if UPLOAD_ACCEL_REDIRECT:
+            return self._accel_redirect(full_path, response)
+        return response
+
+    def _accel_redirect(self, full_path, response: FileResponse) -> Response:
+        relative = os.path.relpath(full_path, self.directory).replace(os.sep, "/")
+        headers = {
+            key: value for key, value in response.headers.items()
+            if key in ("etag", "cache-control", "last-modified", "content-type")
+        }
+        headers["x-accel-redirect"] = UPLOAD_ACCEL_REDIRECT.rstrip("/") + "/" + relative
+        return Response(status_code=response.status_code, headers=headers)
+
+
+def build_upload_files(upload_dir: str = UPLOAD_DIR) -> UploadFiles:
+    os.makedirs(upload_dir, exist_ok=True)
+    return UploadFiles(directory=upload_dir)
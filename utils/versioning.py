@@ -0,0 +1,124 @@
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Iterable, Optional, Tuple, Union
+from fastapi import HTTPException, Request, Response
+from sqlalchemy import Select, func, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm.exc import StaleDataError
+
+
+def touch(obj):
+    """Mark a Products or Categories row as changed; the UPDATE only applies
+    if nobody else changed the row since it was loaded."""
+    obj.version = obj.version + 1
+    obj.updated_at = func.now()
+
+
+async def bump_versions(db: AsyncSession, model, ids: Union[Iterable[int], Select]):
+    """Like ``touch`` for rows that are not loaded. ``ids`` may be a select
+    of the ids, e.g. the products of a renamed category, so that any number
+    of rows is bumped in one statement without binding each id."""
+    if not isinstance(ids, Select):
+        ids = sorted(set(ids))
+        if not ids:
+            return
+    await db.execute(
+        update(model)
+        .where(model.id.in_(ids))
+        .values(version=model.version + 1, updated_at=func.now())
+    )
+
+
+def etag(resource_id: int, version: int) -> str:
+    return f'W/"{resource_id}.{version}"'
+
+
+def _as_utc(value: datetime) -> datetime:
+    # SQLite hands back naive timestamps, always written in UTC.
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+
+def last_modified(updated_at: Optional[datetime]) -> Optional[str]:
+    if updated_at is None:
+        return None
+    return format_datetime(_as_utc(updated_at).replace(microsecond=0), usegmt=True)
+
+
+def _opaque(tag: str) -> str:
+    tag = tag.strip()
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+def _matches(header: str, current: str) -> bool:
+    tags = [_opaque(t) for t in header.split(",")]
+    return "*" in tags or _opaque(current) in tags
+
+
+def validators(resource_id: int, version: int, updated_at: Optional[datetime]) -> dict:
+    headers = {"ETag": etag(resource_id, version)}
+    modified = last_modified(updated_at)
+    if modified:
+        headers["Last-Modified"] = modified
+    return headers
+
+
+def cache_entry(headers: dict, body: str) -> str:
+    """The validators on one line in front of the JSON body, which has no
+    raw newline, so that a cache hit is answered without parsing it."""
+    return f"{headers['ETag']}\t{headers.get('Last-Modified', '')}\n{body}"
+
+
+def read_cache_entry(entry: str) -> Optional[Tuple[dict, str]]:
+    """``(headers, body)`` of a ``cache_entry``, None for anything else."""
+    line, newline, body = entry.partition("\n")
+    if not newline or not line.startswith('W/"'):
+        return None
+    tag, _, modified = line.partition("\t")
+    headers = {"ETag": tag}
+    if modified:
+        headers["Last-Modified"] = modified
+    return headers, body
+
+
+def is_conditional(request: Request) -> bool:
+    return "if-none-match" in request.headers or "if-modified-since" in request.headers
+
+
+def is_not_modified(request: Request, headers: dict) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return _matches(if_none_match, headers["ETag"])
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and "Last-Modified" in headers:
+        try:
+            return parsedate_to_datetime(headers["Last-Modified"]) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def not_modified(headers: dict) -> Response:
+    return Response(status_code=304, headers=headers)
+
+
+def check_if_match(request: Request, resource_id: int, version: int):
+    """Reject a write whose If-Match does not name the current version.
+
+    The ETags are weak, so tags are compared by their opaque part; the
+    check is repeated atomically by the versioned UPDATE on commit.
+    """
+    if_match = request.headers.get("if-match")
+    if if_match is not None and not _matches(if_match, etag(resource_id, version)):
+        raise HTTPException(status_code=412, detail="Resource was modified")
+
+
+async def commit(db: AsyncSession, request: Request):
+    """Commit, turning a lost race on the version check into 412 (the client
+    sent If-Match) or 409."""
+    try:
+        await db.commit()
+    except StaleDataError:
+        await db.rollback()
+        if request.headers.get("if-match") is not None:
+            raise HTTPException(status_code=412, detail="Resource was modified")
+        raise HTTPException(status_code=409, detail="Resource was modified concurrently, retry")